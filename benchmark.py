@@ -0,0 +1,206 @@
+"""Reproducible performance benchmarks against synthetic leagues.
+
+Google Sheets is replaced by the in-process fake from fake_gspread, which
+counts API calls and payload bytes. Results are written as JSON so runs can
+be diffed for regressions:
+
+    python benchmark.py --players 50 500 --matches 1000 10000 --output results.json
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import league
+import models
+import rating_system
+import utils
+from fake_gspread import FakeSpreadsheet
+from league import MATCH_COLUMNS, PLAYER_COLUMNS
+from storage import SheetsStorage
+
+# Per-player benchmarks run over a fixed sample of players
+SAMPLE_SIZE = 50
+
+
+def generate_league(player_count, match_count, seed=0):
+    """Build Players and Matches sheet rows for a synthetic league"""
+    rng = np.random.default_rng(seed)
+    start = datetime(2020, 1, 1)
+    names = [f"player{i:05d}" for i in range(player_count)]
+
+    players = [PLAYER_COLUMNS] + [
+        [name, float(mu), float(sigma), str(start), str(start)]
+        for name, mu, sigma in zip(names, rng.normal(25, 5, player_count), rng.uniform(1, 8.333, player_count))
+    ]
+
+    # Four distinct players per match: a random offset into a shuffled ring
+    first = rng.integers(0, player_count, match_count)
+    step = rng.integers(1, max(2, player_count // 4), match_count)
+    seats = (first[:, None] + step[:, None] * np.arange(4)) % player_count
+    winners = rng.integers(1, 3, match_count)
+    minutes = np.cumsum(rng.integers(1, 30, match_count))
+    matches = [MATCH_COLUMNS] + [
+        [str(start + timedelta(minutes=int(minute))), names[a], names[b], names[c], names[d], int(winner),
+         f"{i:032x}"]
+        for i, (minute, (a, b, c, d), winner) in enumerate(zip(minutes, seats.tolist(), winners))
+    ]
+    return players, matches
+
+
+def fake_sheets(spreadsheet):
+    """Sheets storage backed by a fake spreadsheet"""
+    return SheetsStorage(spreadsheet, url="fake://benchmark")
+
+
+def reset_league(spreadsheet):
+    """A new, not yet loaded default league stored in the fake spreadsheet"""
+    league.get_league_cache.clear()
+    league.get_league_cache().open_storage = lambda league_id, create: fake_sheets(spreadsheet)
+    return league.get_league()
+
+
+def _timed(function, repeat, stats, setup=None):
+    """Run function `repeat` times, each after an untimed setup(); return timings and the API usage of one run"""
+    timings = []
+    usage = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        stats.reset()
+        started = time.perf_counter()
+        calls = function()
+        timings.append(time.perf_counter() - started)
+        usage = stats.snapshot()
+    return timings, usage, calls or 1
+
+
+def run_scenario(player_count, match_count, repeat, seed):
+    """Benchmark every hot path against one synthetic league size"""
+    players_rows, matches_rows = generate_league(player_count, match_count, seed)
+    spreadsheet = FakeSpreadsheet()
+    spreadsheet.add_worksheet('Players', players_rows)
+    spreadsheet.add_worksheet('Matches', matches_rows)
+    current = reset_league(spreadsheet)
+
+    rng = random.Random(seed)
+    names = [row[0] for row in players_rows[1:]]
+    sample = rng.sample(names, min(SAMPLE_SIZE, len(names)))
+
+    def load():
+        models.load_data_from_storage()
+
+    def leaderboard():
+        rating_system.get_leaderboard()
+
+    def player_stats():
+        for name in sample:
+            utils.get_player_stats(name)
+        return len(sample)
+
+    def recent_matches():
+        utils.get_recent_matches(limit=5)
+
+    def frequent_teammates():
+        for name in sample:
+            utils.get_most_frequent_teammates(name)
+        return len(sample)
+
+    def ratings():
+        for _ in range(len(sample)):
+            rating_system.update_ratings(*rng.sample(sample, 4), winner=rng.choice([1, 2]))
+        return len(sample)
+
+    def record():
+        for _ in range(len(sample)):
+            models.record_match(*rng.sample(sample, 4), winner=rng.choice([1, 2]))
+        return len(sample)
+
+    def save_match():
+        # What one recorded match costs on the wire: the delta save
+        rating_system.update_ratings(*rng.sample(sample, 4), winner=1)
+        models.record_match(*rng.sample(sample, 4), winner=1)
+        models.save_data_to_storage()
+
+    def save_full():
+        # Full rewrite of an empty spreadsheet
+        empty = FakeSpreadsheet(spreadsheet.stats)
+        empty.add_worksheet('Players')
+        empty.add_worksheet('Matches')
+        current.storage = fake_sheets(empty)
+        models.save_data_to_storage(rebuild=True)
+        current.storage = fake_sheets(spreadsheet)
+
+    benchmarks = [
+        ('load', load),
+        ('get_leaderboard', leaderboard),
+        ('get_player_stats', player_stats),
+        ('get_recent_matches', recent_matches),
+        ('get_most_frequent_teammates', frequent_teammates),
+        ('update_ratings', ratings),
+        ('record_match', record),
+        ('save_match', save_match),
+        ('save_full', save_full),
+    ]
+
+    # The record benchmarks leave their matches unsaved; save_match must only send its own
+    setups = {'save_match': models.save_data_to_storage}
+
+    results = []
+    for name, function in benchmarks:
+        timings, usage, calls = _timed(function, repeat, spreadsheet.stats, setups.get(name))
+        results.append({
+            'players': player_count,
+            'matches': match_count,
+            'benchmark': name,
+            'repeat': repeat,
+            'calls_per_run': calls,
+            'min_s': min(timings),
+            'median_s': statistics.median(timings),
+            'per_call_s': min(timings) / calls,
+            **usage,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--matches', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args(argv)
+
+    results = []
+    for player_count in args.players:
+        for match_count in args.matches:
+            for result in run_scenario(player_count, match_count, args.repeat, args.seed):
+                results.append(result)
+                print(f"{result['players']:>6} players {result['matches']:>8} matches  "
+                      f"{result['benchmark']:<28} {result['per_call_s'] * 1000:10.3f} ms/call  "
+                      f"{result['api_calls']:>3} calls {result['bytes_sent']:>10} B sent")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
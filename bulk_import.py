@@ -0,0 +1,219 @@
+"""Bulk import of historical matches from CSV or JSON Lines.
+
+Files need the Matches sheet columns: date, team1_player1, team1_player2,
+team2_player1, team2_player2 and winner (1 or 2). Matches are read in
+chunks and validated before anything changes. Then missing players are
+created and the matches are rated in date order. Everything is saved in a
+single batched write.
+
+    python bulk_import.py history.csv [--no-create-players] [--dry-run] [--league ID]
+"""
+import argparse
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from league import (DEFAULT_LEAGUE, MATCH_RESULT_COLUMNS, TEAM_COLUMNS, UnknownLeagueError, get_league,
+                    select_league)
+from match_log import NAT, MatchLog, parse_dates
+from models import (add_players_unsaved, get_write_queue, initialize_data, mark_player_dirty,
+                    save_data, update_last_played)
+from rating_history import RatingHistory
+from rating_system import replay_ratings
+from utils import build_pair_index, build_player_stats_index, build_recent_matches
+
+# Rows read and validated at a time
+IMPORT_CHUNK_SIZE = 5000
+
+# Errors listed before the rest are summarized
+MAX_REPORTED_ERRORS = 20
+
+# How long the CLI waits for storage before giving up
+SAVE_TIMEOUT_SECONDS = 300
+
+
+class MatchImportError(ValueError):
+    """The import file is invalid; `errors` lists the problems by line"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        shown = errors[:MAX_REPORTED_ERRORS]
+        more = len(errors) - len(shown)
+        super().__init__("\n".join(shown + ([f"... and {more} more"] if more else [])))
+
+
+def _format_of(source, fmt):
+    if fmt:
+        return fmt
+    name = source if isinstance(source, str) else getattr(source, 'name', '')
+    return 'jsonl' if str(name).lower().endswith(('.jsonl', '.json', '.ndjson')) else 'csv'
+
+
+def read_match_chunks(source, fmt=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Yield DataFrames of at most chunk_size matches from a path or file object"""
+    if _format_of(source, fmt) == 'jsonl':
+        reader = pd.read_json(source, lines=True, chunksize=chunk_size, dtype=False)
+    else:
+        # Keep names as written: no numeric parsing, no NaN for names like "NA"
+        reader = pd.read_csv(source, chunksize=chunk_size, dtype={column: str for column in TEAM_COLUMNS},
+                             keep_default_na=False, skipinitialspace=True)
+    with reader:
+        yield from reader
+
+
+def _validate_chunk(chunk, first_line, known_players, create_players):
+    """Normalize one chunk; returns (matches, errors, unknown player names).
+
+    known_players maps the text of every existing name to the name itself,
+    since Sheets turns names like "7" into numbers.
+    """
+    missing = [column for column in MATCH_RESULT_COLUMNS if column not in chunk.columns]
+    if missing:
+        return None, [f"Missing columns: {', '.join(missing)}"], set()
+
+    def names(column):
+        text = chunk[column].fillna('').astype(str).str.strip()
+        return text.map(lambda name: known_players.get(name, name))
+
+    matches = pd.DataFrame({
+        'date': parse_dates(chunk['date']),
+        **{column: names(column) for column in TEAM_COLUMNS},
+        'winner': pd.to_numeric(chunk['winner'], errors='coerce'),
+        'match_id': [uuid.uuid4().hex for _ in range(len(chunk))],
+    })
+    seats = matches[TEAM_COLUMNS].to_numpy()
+
+    errors = []
+    bad_date = matches['date'].isna().to_numpy()
+    bad_winner = ~matches['winner'].isin([1, 2]).to_numpy()
+    empty_seat = (seats == '').any(axis=1)
+    repeated = np.array([len(set(row)) < 4 for row in seats.tolist()], dtype=bool)
+    for offset in np.flatnonzero(bad_date | bad_winner | empty_seat | repeated).tolist():
+        problems = [problem for problem, bad in (
+            ("unreadable date", bad_date[offset]),
+            ("winner must be 1 or 2", bad_winner[offset]),
+            ("missing player", empty_seat[offset]),
+            ("a player appears twice", repeated[offset]),
+        ) if bad]
+        errors.append(f"Line {first_line + offset}: {', '.join(problems)}")
+
+    unknown = set(seats.ravel().tolist()) - set(known_players.values()) - {''}
+    if unknown and not create_players:
+        errors.append(f"Unknown players: {', '.join(sorted(unknown))}")
+
+    matches['winner'] = matches['winner'].fillna(0).astype(int)
+    return matches, errors, unknown
+
+
+def import_matches(source, fmt=None, create_players=True, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import matches from a CSV/JSONL path or file object.
+
+    The whole file is validated before the league changes, so an invalid
+    file imports nothing and raises MatchImportError. Returns a summary dict.
+    """
+    league = get_league()
+    with league.lock:
+        known_players = {str(name): name for name in league.player_ids}
+        chunks = []
+        new_players = set()
+        errors = []
+        # CSV data starts on line 2, after the header
+        first_line = 1 if _format_of(source, fmt) == 'jsonl' else 2
+        for chunk in read_match_chunks(source, fmt, chunk_size):
+            matches, chunk_errors, unknown = _validate_chunk(chunk, first_line, known_players, create_players)
+            errors += chunk_errors
+            if matches is None:
+                break
+            chunks.append(matches)
+            new_players |= unknown
+            first_line += len(chunk)
+        if errors:
+            raise MatchImportError(errors)
+
+        match_count = sum(len(matches) for matches in chunks)
+        summary = {'matches': match_count, 'new_players': sorted(new_players), 'full_replay': False}
+        if dry_run or match_count == 0:
+            return summary
+
+        add_players_unsaved(sorted(new_players))
+        imported = MatchLog()
+        for matches in chunks:
+            imported.extend(MatchLog.from_frame(matches, league.player_ids))
+
+        # Matches newer than the whole log continue from the current ratings;
+        # older ones change history, so every rating is replayed from scratch
+        existing_dates = league.matches.column('date')
+        latest = existing_dates.max() if len(existing_dates) else NAT
+        summary['full_replay'] = bool(imported.column('date').min() < latest)
+
+        old_mu = league.players['mu'].to_numpy(dtype=float)
+        old_sigma = league.players['sigma'].to_numpy(dtype=float)
+        league.matches.extend(imported)
+        for matches in chunks:
+            league.unsynced_ids.update(matches['match_id'])
+        if summary['full_replay']:
+            league.rating_history = RatingHistory()
+            mu, sigma = replay_ratings(league.players, league.matches, history=league.rating_history)
+        else:
+            mu, sigma = replay_ratings(league.players, imported, initial=(old_mu, old_sigma),
+                                       history=league.rating_history)
+        league.players['mu'] = mu
+        league.players['sigma'] = sigma
+
+        update_last_played(imported)
+        for idx in np.flatnonzero((mu != old_mu) | (sigma != old_sigma)).tolist():
+            mark_player_dirty(idx)
+
+        league.player_stats = build_player_stats_index(league.matches, league.player_names())
+        league.pair_stats = build_pair_index(league.matches)
+        league.recent_matches = build_recent_matches(league.matches, league.player_names())
+        league.touch_ratings()
+        if summary['full_replay']:
+            # Replayed ratings no longer extend the sync checkpoint
+            league.synced_ratings = None
+        league.bump_version(ratings=True)
+        # New players and matches become appends, rating changes row rewrites: one batchUpdate
+        save_data()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="CSV or JSON Lines file")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="default: from the file extension")
+    parser.add_argument('--no-create-players', action='store_true', help="reject unknown player names")
+    parser.add_argument('--dry-run', action='store_true', help="validate only")
+    parser.add_argument('--league', default=DEFAULT_LEAGUE,
+                        help="league to import into; a new SQLite league is created")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.path):
+        parser.error(f"No such file: {args.path}")
+    select_league(args.league)
+    try:
+        get_league(create=not args.dry_run)
+    except UnknownLeagueError:
+        parser.error(f"Unknown league: {args.league}")
+
+    # Import on top of the current league, not a possibly older local snapshot
+    initialize_data(background=False)
+    try:
+        summary = import_matches(args.path, args.format, create_players=not args.no_create_players,
+                                 dry_run=args.dry_run)
+    except MatchImportError as e:
+        print(f"Import failed:\n{e}")
+        return 1
+
+    action = "Validated" if args.dry_run else "Imported"
+    print(f"{action} {summary['matches']} matches, {len(summary['new_players'])} new players"
+          + (" (all ratings replayed)" if summary['full_replay'] else ""))
+    if not args.dry_run:
+        if not get_write_queue().flush(timeout=SAVE_TIMEOUT_SECONDS):
+            print(f"Saving to storage did not finish: {get_write_queue().last_error}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
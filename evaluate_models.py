@@ -0,0 +1,167 @@
+"""Offline comparison of rating models on the league's match history.
+
+Every configuration in a grid of OpenSkill models and beta/tau values
+replays the history in date order, predicting each match before rating it.
+Configurations are scored by log-loss, Brier score and accuracy of those
+predictions, and run in parallel across a process pool. Results are written
+as JSON, like the benchmarks:
+
+    python evaluate_models.py history.csv --models PlackettLuce BradleyTerryFull --beta 2.08 4.17 --tau 0.083
+
+Without a file, the match log snapshot the app keeps in .cache/ for a league
+(--league, by default the default league) is used.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from openskill.models import MODELS
+
+from bulk_import import read_match_chunks
+from league import DEFAULT_LEAGUE, DEFAULT_MU, DEFAULT_SIGMA, TEAM_COLUMNS, snapshot_paths
+from match_log import MatchLog, parse_dates
+
+MODEL_NAMES = [model.__name__ for model in MODELS]
+
+# Predictions are clipped this far from 0 and 1 so one confident miss cannot make log-loss infinite
+MIN_PROBABILITY = 1e-15
+
+# History shared with the worker processes once, instead of with every configuration
+_history = None
+
+
+def load_history(path=None, fmt=None, league_id=DEFAULT_LEAGUE):
+    """(ids, team1_won) arrays of every match in date order, from a CSV/JSONL file or a league's snapshot"""
+    if path is None:
+        match_log = MatchLog.load(snapshot_paths(league_id)[0])
+        ids, winner, dates = match_log.player_ids(), match_log.column('winner'), match_log.column('date')
+    else:
+        frame = pd.concat(list(read_match_chunks(path, fmt)), ignore_index=True)
+        names = frame[TEAM_COLUMNS].fillna('').astype(str).apply(lambda column: column.str.strip())
+        codes, _ = pd.factorize(names.to_numpy().ravel())
+        ids = codes.reshape(-1, 4)
+        winner = pd.to_numeric(frame['winner'], errors='coerce').to_numpy()
+        dates = parse_dates(frame['date']).to_numpy().view(np.int64)
+        # Rows the importer would reject cannot be replayed either
+        seats = names.to_numpy()
+        valid = (np.isin(winner, [1, 2]) & (seats != '').all(axis=1)
+                 & np.array([len(set(row)) == 4 for row in seats.tolist()], dtype=bool))
+        ids, winner, dates = ids[valid], winner[valid], dates[valid]
+
+    # Stable sort keeps file order for matches with equal timestamps, as replay_ratings does
+    order = np.argsort(dates, kind='stable')
+    return ids[order], winner[order] == 1
+
+
+def _init_worker(ids, team1_won):
+    global _history
+    _history = (ids, team1_won)
+
+
+def evaluate(config):
+    """Replay the history under one configuration; returns the configuration with its scores"""
+    ids, team1_won = _history
+    parameters = {name: config[name] for name in ('beta', 'tau') if config[name] is not None}
+    model = next(model for model in MODELS if model.__name__ == config['model'])(**parameters)
+    ratings = [model.rating(mu=DEFAULT_MU, sigma=DEFAULT_SIGMA) for _ in range(int(ids.max()) + 1)] if len(ids) else []
+
+    log_loss = brier = correct = 0.0
+    scored = 0
+    started = time.perf_counter()
+    for index, ((a, b, c, d), won) in enumerate(zip(ids.tolist(), team1_won.tolist())):
+        teams = [[ratings[a], ratings[b]], [ratings[c], ratings[d]]]
+        if index >= config['burn_in']:
+            # Probability the model gave the actual winner
+            team1_probability = model.predict_win(teams)[0]
+            probability = team1_probability if won else 1 - team1_probability
+            log_loss -= math.log(min(max(probability, MIN_PROBABILITY), 1 - MIN_PROBABILITY))
+            brier += (1 - probability) ** 2
+            correct += 1.0 if probability > 0.5 else 0.5 if probability == 0.5 else 0.0
+            scored += 1
+        (ratings[a], ratings[b]), (ratings[c], ratings[d]) = model.rate(teams, ranks=[0, 1] if won else [1, 0])
+    elapsed = time.perf_counter() - started
+
+    return {
+        **config,
+        'matches': len(ids),
+        'scored': scored,
+        'log_loss': log_loss / scored if scored else None,
+        'brier': brier / scored if scored else None,
+        'accuracy': correct / scored if scored else None,
+        'seconds': elapsed,
+        'matches_per_s': len(ids) / elapsed if elapsed else None,
+    }
+
+
+def _format_parameter(value):
+    return 'default' if value is None else f"{value:g}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', help="CSV or JSON Lines file (default: the local match log snapshot)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="default: from the file extension")
+    parser.add_argument('--league', default=DEFAULT_LEAGUE, help="league whose snapshot is used without a file")
+    parser.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=MODEL_NAMES)
+    parser.add_argument('--beta', type=float, nargs='+', default=[None], help="default: each model's own")
+    parser.add_argument('--tau', type=float, nargs='+', default=[None], help="default: each model's own")
+    parser.add_argument('--burn-in', type=int, default=0, help="matches rated before scoring starts")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='model_evaluation.json')
+    args = parser.parse_args(argv)
+    if args.path is not None and not os.path.exists(args.path):
+        parser.error(f"No such file: {args.path}")
+
+    try:
+        ids, team1_won = load_history(args.path, args.format, args.league)
+    except (OSError, ValueError) as e:
+        parser.error(f"Cannot read the match history: {e}")
+    configs = [{'model': model, 'beta': beta, 'tau': tau, 'burn_in': args.burn_in}
+               for model, beta, tau in itertools.product(args.models, args.beta, args.tau)]
+    print(f"Evaluating {len(configs)} configurations on {len(ids)} matches with {args.workers} workers")
+
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(ids, team1_won)) as pool:
+        for result in pool.map(evaluate, configs):
+            results.append(result)
+            print(f"{result['model']:<24} beta {_format_parameter(result['beta']):>8} "
+                  f"tau {_format_parameter(result['tau']):>8}  {result['matches_per_s'] or 0:10.0f} matches/s")
+    elapsed = time.perf_counter() - started
+
+    results.sort(key=lambda result: math.inf if result['log_loss'] is None else result['log_loss'])
+    print(f"\n{'model':<24} {'beta':>8} {'tau':>8} {'log-loss':>9} {'brier':>7} {'accuracy':>9}")
+    for result in results:
+        if result['scored']:
+            print(f"{result['model']:<24} {_format_parameter(result['beta']):>8} "
+                  f"{_format_parameter(result['tau']):>8} {result['log_loss']:9.4f} "
+                  f"{result['brier']:7.4f} {result['accuracy']:9.1%}")
+    replayed = len(ids) * len(configs)
+    print(f"\n{replayed} matches replayed in {elapsed:.1f} s ({replayed / elapsed:.0f} matches/s overall)")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'source': args.path or snapshot_paths(args.league)[0],
+            'workers': args.workers,
+            'seconds': elapsed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
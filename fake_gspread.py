@@ -0,0 +1,147 @@
+"""In-process stand-in for the parts of gspread the app uses.
+
+Worksheets keep their cells as lists in memory. Every API call is counted
+and the JSON size of what would have gone over the wire is recorded, so
+benchmarks can report round-trips and payload bytes without network access.
+"""
+import json
+from collections import Counter
+
+from gspread.utils import a1_to_rowcol, numericise_all
+
+
+class ApiStats:
+    """Counts API calls and request/response payload bytes"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def record(self, method, sent=None, received=None):
+        self.calls[method] += 1
+        if sent is not None:
+            self.bytes_sent += _payload_size(sent)
+        if received is not None:
+            self.bytes_received += _payload_size(received)
+
+    def reset(self):
+        self.calls.clear()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def snapshot(self):
+        return {
+            'api_calls': sum(self.calls.values()),
+            'calls_by_method': dict(self.calls),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+        }
+
+
+def _payload_size(payload):
+    return len(json.dumps(payload, default=str).encode('utf-8'))
+
+
+def _cell_value(cell):
+    value = cell.get('userEnteredValue', {})
+    return next(iter(value.values()), '')
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, sheet_id, title, rows=None):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.rows = [list(row) for row in rows or []]
+
+    def get_all_records(self, expected_headers=None):
+        self.spreadsheet.stats.record('get_all_records', received=self.rows)
+        if not self.rows:
+            return []
+        header = self.rows[0]
+        return [dict(zip(header, numericise_all([str(value) for value in row]))) for row in self.rows[1:]]
+
+    def get(self, range_name):
+        """Formatted values of an open-ended range like 'A5:G', without trailing empty cells"""
+        first_row = a1_to_rowcol(range_name.split(':')[0])[0]
+        values = [[str(value) for value in row] for row in self.rows[first_row - 1:]]
+        for row in values:
+            while row and row[-1] == '':
+                row.pop()
+        self.spreadsheet.stats.record('get', received=values)
+        return values
+
+    def col_values(self, col):
+        values = [str(row[col - 1]) if len(row) >= col else '' for row in self.rows]
+        self.spreadsheet.stats.record('col_values', received=values)
+        return values
+
+    def row_values(self, row):
+        values = [str(value) for value in self.rows[row - 1]] if len(self.rows) >= row else []
+        while values and values[-1] == '':
+            values.pop()
+        self.spreadsheet.stats.record('row_values', received=values)
+        return values
+
+    def update(self, range_name, values=None, **kwargs):
+        # Like gspread 5.12, accept update(values) as well as update(range_name, values)
+        if values is None:
+            range_name, values = 'A1', range_name
+        self.spreadsheet.stats.record('update', sent=values)
+        row, col = a1_to_rowcol(range_name)
+        for offset, new_row in enumerate(values):
+            while len(self.rows) < row + offset:
+                self.rows.append([])
+            current = self.rows[row + offset - 1]
+            current.extend([''] * (col - 1 + len(new_row) - len(current)))
+            current[col - 1:col - 1 + len(new_row)] = list(new_row)
+
+    def append_rows(self, values, **kwargs):
+        self.spreadsheet.stats.record('append_rows', sent=values)
+        self.rows.extend(list(row) for row in values)
+
+
+class FakeSpreadsheet:
+    def __init__(self, stats=None):
+        self.stats = stats or ApiStats()
+        self._worksheets = {}
+
+    def add_worksheet(self, title, rows=None):
+        worksheet = FakeWorksheet(self, len(self._worksheets), title, rows)
+        self._worksheets[title] = worksheet
+        return worksheet
+
+    def worksheet(self, title):
+        self.stats.record('worksheet')
+        return self._worksheets[title]
+
+    def batch_update(self, body):
+        """Apply appendCells/updateCells requests like the Sheets batchUpdate endpoint"""
+        self.stats.record('batch_update', sent=body)
+        by_id = {worksheet.id: worksheet for worksheet in self._worksheets.values()}
+        for request in body['requests']:
+            if 'appendCells' in request:
+                append = request['appendCells']
+                by_id[append['sheetId']].rows.extend(
+                    [_cell_value(cell) for cell in row['values']] for row in append['rows'])
+            elif 'updateCells' in request:
+                update = request['updateCells']
+                worksheet = by_id[update['range']['sheetId']]
+                start = update['range']['startRowIndex']
+                for offset, row in enumerate(update['rows']):
+                    while len(worksheet.rows) <= start + offset:
+                        worksheet.rows.append([])
+                    worksheet.rows[start + offset] = [_cell_value(cell) for cell in row['values']]
+            else:
+                raise NotImplementedError(f"Unsupported request: {sorted(request)}")
+        return {'replies': [{} for _ in body['requests']]}
+
+
+class FakeClient:
+    def __init__(self, spreadsheet=None):
+        self.spreadsheet = spreadsheet or FakeSpreadsheet()
+
+    def open_by_url(self, url):
+        self.spreadsheet.stats.record('open_by_url')
+        return self.spreadsheet
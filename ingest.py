@@ -0,0 +1,217 @@
+"""Headless match ingestion for table buttons and chat bots.
+
+Records results through the same rating and persistence code as the app,
+without Streamlit reruns or rendering. The server answers as soon as a
+match is rated; saving happens in the background as in the app:
+
+    python ingest.py serve [--host 127.0.0.1] [--port 8502]
+    python ingest.py record Alice Bob Carol Dave --winner 1
+
+POST /matches takes one result or a list of them, recorded in order:
+
+    {"team1_player1": "Alice", "team1_player2": "Bob",
+     "team2_player1": "Carol", "team2_player2": "Dave", "winner": 1}
+
+GET /health reports the match count and pending writes. Both act on the
+default league unless a ?league=<id> parameter names another. Set
+WUZZLER_INGEST_TOKEN to require "Authorization: Bearer <token>".
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from league import DEFAULT_LEAGUE, TEAM_COLUMNS, UnknownLeagueError, get_league, using_league
+from models import get_write_queue, initialize_data, pending_writes
+from rating_system import record_match_result
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1 << 20
+
+# How long the CLI and a stopping server wait for storage before giving up
+SAVE_TIMEOUT_SECONDS = 60
+
+
+class ResultError(ValueError):
+    """Submitted results are invalid; `errors` lists the problems"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+
+def validate_results(results):
+    """Check results against the league; returns them as (team1_player1, ..., winner) tuples"""
+    if isinstance(results, dict):
+        results = [results]
+    if not isinstance(results, list) or not results:
+        raise ResultError(["Expected a result object or a non-empty list of them"])
+
+    league = get_league()
+    # Names arrive as text while the league may hold names like "7" as numbers
+    known = {str(name): name for name in league.player_ids}
+    errors = []
+    validated = []
+    for position, result in enumerate(results):
+        if not isinstance(result, dict):
+            errors.append(f"Result {position}: expected an object")
+            continue
+        missing = [column for column in TEAM_COLUMNS + ['winner'] if column not in result]
+        if missing:
+            errors.append(f"Result {position}: missing {', '.join(missing)}")
+            continue
+        names = [str(result[column]).strip() for column in TEAM_COLUMNS]
+        problems = []
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            problems.append(f"unknown players {', '.join(unknown)}")
+        if len(set(names)) < 4:
+            problems.append("a player appears twice")
+        winner = result['winner']
+        # True == 1 and 1.0 == 1, so the type is checked before the value
+        if isinstance(winner, bool) or not isinstance(winner, (int, str)) or str(winner) not in ('1', '2'):
+            problems.append("winner must be 1 or 2")
+        if problems:
+            errors.append(f"Result {position}: {', '.join(problems)}")
+            continue
+        validated.append(tuple(known[name] for name in names) + (int(winner),))
+    if errors:
+        raise ResultError(errors)
+    return validated
+
+
+def ingest_results(results):
+    """Validate and record results in order; returns the new match ids.
+
+    Nothing is recorded unless every result is valid.
+    """
+    # Catches up with other writers when due, in the background
+    initialize_data()
+    league = get_league()
+    match_ids = []
+    with league.lock:
+        for result in validate_results(results):
+            record_match_result(*result)
+            match_ids.append(league.matches.column('match_id')[-1].decode())
+    return match_ids
+
+
+class IngestHandler(BaseHTTPRequestHandler):
+    server_version = "WuzzlerIngest/1.0"
+
+    def do_GET(self):
+        path, league_id = self._route()
+        if path != '/health':
+            return self._reply(404, {'error': "Not found"})
+        with using_league(league_id):
+            try:
+                league = get_league()
+            except UnknownLeagueError:
+                return self._reply(404, {'error': f"Unknown league: {league_id}"})
+            self._reply(200, {'status': 'ok', 'matches': len(league.matches), 'pending_writes': pending_writes()})
+
+    def do_POST(self):
+        path, league_id = self._route()
+        if path != '/matches':
+            return self._reply(404, {'error': "Not found"})
+        if not self._authorized():
+            return self._reply(401, {'error': "Missing or wrong token"})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self._reply(400, {'errors': ["Content-Length must be a non-negative integer"]})
+        if length > MAX_BODY_BYTES:
+            return self._reply(413, {'error': f"Body larger than {MAX_BODY_BYTES} bytes"})
+        try:
+            results = json.loads(self.rfile.read(length) or b'null')
+        except ValueError:
+            return self._reply(400, {'errors': ["Body is not valid JSON"]})
+        try:
+            with using_league(league_id):
+                match_ids = ingest_results(results)
+        except UnknownLeagueError:
+            return self._reply(404, {'error': f"Unknown league: {league_id}"})
+        except ResultError as e:
+            return self._reply(400, {'errors': e.errors})
+        self._reply(201, {'recorded': len(match_ids), 'match_ids': match_ids})
+
+    def _route(self):
+        """(path, league id) of the request"""
+        url = urlsplit(self.path)
+        return url.path, parse_qs(url.query).get('league', [DEFAULT_LEAGUE])[0]
+
+    def _authorized(self):
+        token = os.environ.get('WUZZLER_INGEST_TOKEN')
+        if not token:
+            return True
+        return hmac.compare_digest(self.headers.get('Authorization', ''), f"Bearer {token}")
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+
+def serve(host='127.0.0.1', port=8502):
+    """Serve the ingestion API until interrupted"""
+    initialize_data(background=False)
+    server = ThreadingHTTPServer((host, port), IngestHandler)
+    logger.info("Listening on http://%s:%d", host, server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        get_write_queue().flush(timeout=SAVE_TIMEOUT_SECONDS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help="run the HTTP API")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8502)
+    record_parser = commands.add_parser('record', help="record one match and wait until it is saved")
+    record_parser.add_argument('players', nargs=4, metavar='PLAYER', help="team 1 player 1 and 2, then team 2")
+    record_parser.add_argument('--winner', type=int, choices=[1, 2], required=True)
+    record_parser.add_argument('--league', default=DEFAULT_LEAGUE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.command == 'serve':
+        serve(args.host, args.port)
+        return 0
+
+    try:
+        with using_league(args.league):
+            initialize_data(background=False)
+            match_ids = ingest_results(dict(zip(TEAM_COLUMNS, args.players), winner=args.winner))
+    except UnknownLeagueError:
+        print(f"Unknown league: {args.league}")
+        return 1
+    except ResultError as e:
+        print(f"Not recorded: {e}")
+        return 1
+    if not get_write_queue().flush(timeout=SAVE_TIMEOUT_SECONDS):
+        print(f"Saving did not finish: {get_write_queue().last_error}")
+        return 1
+    print(f"Recorded match {match_ids[0]}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
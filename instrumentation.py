@@ -0,0 +1,182 @@
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+
+# Timings kept per operation for the rolling percentiles
+WINDOW_SIZE = 1000
+PERCENTILES = (0.5, 0.9, 0.99)
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = 'wuzzler'
+
+
+def _percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    """Process-wide timers and Google Sheets API counters.
+
+    Each operation keeps its last WINDOW_SIZE durations, so percentiles follow
+    current behaviour instead of averaging over the whole uptime. Counts,
+    totals and errors are cumulative.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.durations = {}
+            self.counts = Counter()
+            self.errors = Counter()
+            self.total_seconds = Counter()
+            self.api_calls = Counter()
+            self.bytes_sent = 0
+            self.bytes_received = 0
+
+    def observe(self, name, seconds, error=False):
+        """Record one run of an operation"""
+        with self.lock:
+            window = self.durations.get(name)
+            if window is None:
+                window = self.durations[name] = deque(maxlen=WINDOW_SIZE)
+            window.append(seconds)
+            self.counts[name] += 1
+            self.total_seconds[name] += seconds
+            if error:
+                self.errors[name] += 1
+
+    def count_api_call(self, method, sent=0, received=0):
+        """Record one HTTP round-trip to Google and its payload sizes in bytes"""
+        with self.lock:
+            self.api_calls[method] += 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def snapshot(self):
+        """Plain-dict copy of every metric, safe to serialize"""
+        with self.lock:
+            operations = {}
+            for name, window in self.durations.items():
+                ordered = sorted(window)
+                operations[name] = {
+                    'count': self.counts[name],
+                    'errors': self.errors[name],
+                    'total_s': self.total_seconds[name],
+                    'last_s': window[-1],
+                    **{f"p{round(q * 100)}_s": _percentile(ordered, q) for q in PERCENTILES},
+                }
+            return {
+                'started_at': self.started_at,
+                'uptime_s': time.time() - self.started_at,
+                'operations': operations,
+                'api': {
+                    'calls': sum(self.api_calls.values()),
+                    'calls_by_method': dict(self.api_calls),
+                    'bytes_sent': self.bytes_sent,
+                    'bytes_received': self.bytes_received,
+                },
+            }
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+
+metrics = Metrics()
+
+
+def timed(name):
+    """Decorator recording every call of the function under `name`"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def instrument_session(session):
+    """Count every request an HTTP session (gspread's AuthorizedSession) makes"""
+    def count(response, *args, **kwargs):
+        body = response.request.body
+        metrics.count_api_call(response.request.method,
+                               sent=len(body) if body else 0,
+                               received=len(response.content))
+    session.hooks['response'].append(count)
+    return session
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def to_prometheus(snapshot=None):
+    """Render a metrics snapshot in the Prometheus text exposition format"""
+    snapshot = metrics.snapshot() if snapshot is None else snapshot
+    seconds = f"{METRIC_PREFIX}_operation_seconds"
+    lines = [f"# HELP {seconds} Duration of instrumented operations over the rolling window",
+             f"# TYPE {seconds} summary"]
+    for name, operation in sorted(snapshot['operations'].items()):
+        label = f'operation="{_label(name)}"'
+        for q in PERCENTILES:
+            lines.append(f'{seconds}{{{label},quantile="{q}"}} {operation[f"p{round(q * 100)}_s"]}')
+        lines.append(f"{seconds}_sum{{{label}}} {operation['total_s']}")
+        lines.append(f"{seconds}_count{{{label}}} {operation['count']}")
+
+    errors = f"{METRIC_PREFIX}_operation_errors_total"
+    lines += [f"# HELP {errors} Instrumented operations that raised", f"# TYPE {errors} counter"]
+    for name, operation in sorted(snapshot['operations'].items()):
+        lines.append(f'{errors}{{operation="{_label(name)}"}} {operation["errors"]}')
+
+    api = snapshot['api']
+    calls = f"{METRIC_PREFIX}_api_calls_total"
+    lines += [f"# HELP {calls} HTTP requests sent to Google", f"# TYPE {calls} counter"]
+    for method, count in sorted(api['calls_by_method'].items()):
+        lines.append(f'{calls}{{method="{_label(method)}"}} {count}')
+
+    payload = f"{METRIC_PREFIX}_api_bytes_total"
+    lines += [f"# HELP {payload} Request and response body bytes exchanged with Google",
+              f"# TYPE {payload} counter",
+              f'{payload}{{direction="sent"}} {api["bytes_sent"]}',
+              f'{payload}{{direction="received"}} {api["bytes_received"]}']
+    return "\n".join(lines) + "\n"
+
+
+def export_metrics(path):
+    """Atomically write the current metrics; `.prom`/`.txt` files get Prometheus text, others JSON"""
+    snapshot = metrics.snapshot()
+    if path.endswith(('.prom', '.txt')):
+        content = to_prometheus(snapshot)
+    else:
+        content = json.dumps(snapshot, indent=2)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,309 @@
+import contextlib
+import contextvars
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+import pandas as pd
+import streamlit as st
+
+from match_log import MatchLog
+
+PLAYER_COLUMNS = ['name', 'mu', 'sigma', 'created_at', 'last_played']
+MATCH_COLUMNS = ['date', 'team1_player1', 'team1_player2', 'team2_player1', 'team2_player2', 'winner', 'match_id']
+# Columns every Matches sheet has; match_id was added later
+MATCH_RESULT_COLUMNS = MATCH_COLUMNS[:-1]
+TEAM_COLUMNS = ['team1_player1', 'team1_player2', 'team2_player1', 'team2_player2']
+
+# Rating every new player starts with
+DEFAULT_MU = 25.0  # Default OpenSkill mu value
+DEFAULT_SIGMA = 8.333  # Default OpenSkill sigma value
+
+# League served without a ?league= URL parameter, stored where a single-league
+# deployment stores its data
+DEFAULT_LEAGUE = 'default'
+# League ids end up in file names, so they are kept to safe characters
+LEAGUE_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+# Estimated memory the loaded leagues may use before the least recently used
+# ones are evicted; WUZZLER_LEAGUE_MEMORY_MB overrides it
+LEAGUE_MEMORY_BUDGET_BYTES = int(float(os.environ.get('WUZZLER_LEAGUE_MEMORY_MB', 512)) * 2**20)
+
+# Local warm-start snapshot: the match log, memory-mapped on restore, and the
+# rest of the league state as of the last sync. Other leagues keep theirs
+# under .cache/leagues/<league id>/
+MATCH_SNAPSHOT_PATH = os.path.join('.cache', 'matches.npy')
+STATE_SNAPSHOT_PATH = os.path.join('.cache', 'league.pkl')
+
+# Matches kept pre-rendered for the Recent Matches panel
+RECENT_MATCHES_SIZE = 50
+
+# How often storage is polled for rows other writers appended
+LEAGUE_REFRESH_SECONDS = 30
+
+# Rough in-memory size of one entry of the per-player and per-pair stats indexes
+_STATS_ENTRY_BYTES = 400
+
+# League the current session or thread works on: (league id, pinned League or None)
+_current_league = contextvars.ContextVar('current_league', default=(DEFAULT_LEAGUE, None))
+
+
+class UnknownLeagueError(KeyError):
+    """No storage is configured for the requested league"""
+
+
+def snapshot_paths(league_id):
+    """(match log, state) snapshot paths of a league"""
+    if league_id == DEFAULT_LEAGUE:
+        return MATCH_SNAPSHOT_PATH, STATE_SNAPSHOT_PATH
+    directory = os.path.join('.cache', 'leagues', league_id)
+    return os.path.join(directory, 'matches.npy'), os.path.join(directory, 'league.pkl')
+
+
+class League:
+    """In-memory state of one league, shared by every session in the process.
+
+    Sessions read the DataFrames and indexes directly instead of holding their
+    own copies. Every mutation happens under `lock` and bumps `version`, which
+    sessions compare against to drop their derived views.
+    """
+
+    def __init__(self, league_id=DEFAULT_LEAGUE, storage=None):
+        self.league_id = league_id
+        # Backend the league is loaded from and saved to
+        self.storage = storage
+        self.match_snapshot_path, self.state_snapshot_path = snapshot_paths(league_id)
+
+        self.players = pd.DataFrame(columns=PLAYER_COLUMNS)
+        self.matches = MatchLog()
+        self.player_stats = {}
+        # player id -> other player id -> [games with, wins with, games against, wins against]
+        self.pair_stats = {}
+        # Newest first, already formatted for display
+        self.recent_matches = deque(maxlen=RECENT_MATCHES_SIZE)
+
+        # Player registry: name -> dense integer id, which is also the player's row label
+        # and the id the match log stores
+        self.player_ids = {}
+
+        # Delta-save bookkeeping: rows already in the sheets and players changed since
+        self.persisted_players = 0
+        self.persisted_matches = 0
+        self.dirty_players = set()
+
+        # Multi-writer sync: Matches sheet rows merged so far (the next row's sequence
+        # number), ids of our own matches not yet seen there, and the sheet row of each
+        # player as far as it is known
+        self.synced_matches = 0
+        self.unsynced_ids = set()
+        self.player_rows = {}
+        # (mu, sigma) arrays after the synced rows, or None after a full replay
+        self.synced_ratings = None
+        # True while a background sync is running
+        self.syncing = False
+        # RatingHistory of every rated match, or None until rating_system rebuilds it
+        self.rating_history = None
+        # WindowStats over the match log, rebuilt by utils when it falls behind
+        self.window_stats = None
+
+        self.version = 0
+        # Bumped only when ratings or the set of players change, for views that ignore the rest
+        self.ratings_version = 0
+        # Per-player rating revisions for caches keyed by player ids; ratings_epoch
+        # invalidates all of them at once (reloads, replays, imports)
+        self.rating_revisions = {}
+        self.ratings_epoch = 0
+        self.team_strengths = {}
+        self.loaded_at = None
+        self.lock = threading.RLock()
+        self._cache = {}
+
+    def sync_player_registry(self):
+        """Rebuild the name -> id index from the Players DataFrame"""
+        self.player_ids = {name: idx for idx, name in enumerate(self.players['name'])}
+
+    def player_names(self):
+        """Array mapping player id -> name"""
+        return self.players['name'].to_numpy()
+
+    def match_frame(self, start=0, stop=None):
+        """Match log rows [start, stop) as a DataFrame with player names"""
+        return self.matches.to_frame(self.player_names(), start, stop)
+
+    def player_id(self, name):
+        """O(1) id lookup; raises KeyError for unknown players"""
+        try:
+            return self.player_ids[name]
+        except KeyError:
+            raise KeyError(f"Unknown player: {name}") from None
+
+    def bump_version(self, ratings=False):
+        """Mark the league as changed so sessions and caches refresh; pass ratings=True if ratings changed"""
+        self.version += 1
+        if ratings:
+            self.ratings_version += 1
+
+    def touch_ratings(self, ids=None):
+        """Record that the ratings of `ids` (by default every player) changed"""
+        if ids is None:
+            self.ratings_epoch += 1
+            self.rating_revisions = {}
+            self.team_strengths = {}
+            return
+        for player_id in ids:
+            self.rating_revisions[player_id] = self.rating_revisions.get(player_id, 0) + 1
+
+    def rating_revision(self, player_id):
+        return self.rating_revisions.get(player_id, 0)
+
+    def is_stale(self):
+        """True if the league was never loaded or is due for a reload"""
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > LEAGUE_REFRESH_SECONDS
+
+    def cached(self, key, compute, version=None):
+        """Memoize compute() until `version` (by default the league version) changes"""
+        with self.lock:
+            version = self.version if version is None else version
+            entry = self._cache.get(key)
+            if entry is None or entry[0] != version:
+                entry = self._cache[key] = (version, compute())
+            return entry[1]
+
+    def memory_usage(self):
+        """Estimated bytes held by the league's data and indexes"""
+        with self.lock:
+            usage = int(self.players.memory_usage(deep=True).sum()) + self.matches.nbytes
+            entries = len(self.player_stats) + sum(len(pairs) for pairs in self.pair_stats.values())
+            usage += entries * _STATS_ENTRY_BYTES
+            if self.rating_history is not None:
+                usage += self.rating_history.nbytes
+            if self.window_stats is not None:
+                usage += self.window_stats.nbytes
+            return usage
+
+    def is_evictable(self):
+        """True if every change was handed to the write queue and no sync is running.
+
+        Queued changesets carry their own storage handle, so they are saved
+        after the league is dropped, and its next load or sync reads them back.
+        Dirty players still wait for a save, which would be lost with the league.
+        """
+        return (not self.syncing and not self.dirty_players
+                and self.persisted_players == len(self.players)
+                and self.persisted_matches == len(self.matches))
+
+
+class LeagueCache:
+    """Loaded leagues by id, least recently used first.
+
+    Leagues are created on first use with their storage backend from
+    `open_storage(league_id, create)`. trim() evicts the least recently used
+    leagues while the estimated memory of all of them exceeds `budget`; a
+    league is loaded again from its snapshot or storage when next requested.
+    """
+
+    def __init__(self, open_storage, budget=LEAGUE_MEMORY_BUDGET_BYTES):
+        self.open_storage = open_storage
+        self.budget = budget
+        self._leagues = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._leagues)
+
+    def __contains__(self, league_id):
+        return league_id in self._leagues
+
+    def get(self, league_id, create=False):
+        """The league with this id, loading its storage handle on first use"""
+        with self._lock:
+            league = self._leagues.get(league_id)
+            if league is not None:
+                self._leagues.move_to_end(league_id)
+                return league
+        if not LEAGUE_ID_PATTERN.fullmatch(league_id):
+            raise UnknownLeagueError(league_id)
+        # Opened outside the lock: a backend may check files or secrets first
+        storage = self.open_storage(league_id, create)
+        with self._lock:
+            # Another session may have created it meanwhile
+            league = self._leagues.setdefault(league_id, League(league_id, storage))
+            self._leagues.move_to_end(league_id)
+            return league
+
+    def trim(self, keep=None):
+        """Evict least recently used leagues until the rest fit the budget; returns the evicted ids"""
+        with self._lock:
+            leagues = list(self._leagues.items())
+        usage = {league_id: league.memory_usage() for league_id, league in leagues}
+        total = sum(usage.values())
+        evicted = []
+        # The most recently used league always stays
+        for league_id, league in leagues[:-1]:
+            if total <= self.budget:
+                break
+            if league_id == keep or not league.lock.acquire(blocking=False):
+                continue
+            try:
+                if not league.is_evictable():
+                    continue
+                with self._lock:
+                    if self._leagues.get(league_id) is league:
+                        del self._leagues[league_id]
+                        evicted.append(league_id)
+                        total -= usage[league_id]
+            finally:
+                league.lock.release()
+        return evicted
+
+
+@st.cache_resource
+def get_league_cache():
+    """The process-wide store of loaded leagues"""
+    # Imported here to avoid a circular import: storage builds on this module
+    from storage import open_storage
+    return LeagueCache(open_storage)
+
+
+def get_league(league_id=None, create=False):
+    """The shared store of a league, by default the current one.
+
+    Raises UnknownLeagueError for leagues without storage unless `create`
+    asks for storage to be set up where that is possible.
+    """
+    if league_id is None:
+        league_id, league = _current_league.get()
+        if league is not None:
+            return league
+    return get_league_cache().get(league_id, create)
+
+
+def current_league_id():
+    """Id of the league the current session or thread works on"""
+    return _current_league.get()[0]
+
+
+def select_league(league_id):
+    """Make `league_id` the current league of this thread, e.g. for a script run"""
+    _current_league.set((league_id, None))
+
+
+def pin_league(league):
+    """Make `league` itself the current league until the next select_league().
+
+    The cache may evict a league while a session still works on it. Without
+    the pin, the rest of the run would get a new, not yet loaded league.
+    """
+    _current_league.set((league.league_id, league))
+
+
+@contextlib.contextmanager
+def using_league(league_id):
+    """Make `league_id` the current league inside the with block"""
+    token = _current_league.set((league_id, None))
+    try:
+        yield
+    finally:
+        _current_league.reset(token)
@@ -0,0 +1,140 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# On-disk layout: one packed 57-byte record per match
+MATCH_DTYPE = np.dtype([
+    ('date', '<i8'),  # epoch nanoseconds, NaT for unparseable dates
+    ('team1_player1', '<i4'),
+    ('team1_player2', '<i4'),
+    ('team2_player1', '<i4'),
+    ('team2_player2', '<i4'),
+    ('winner', 'i1'),  # 1 for team1, 2 for team2
+    ('match_id', 'S32'),  # UUID hex, empty for matches recorded before ids existed
+])
+SEAT_COLUMNS = ['team1_player1', 'team1_player2', 'team2_player1', 'team2_player2']
+NAT = np.iinfo(np.int64).min
+
+
+def parse_dates(values):
+    """Parse stored date strings, which may or may not carry microseconds"""
+    try:
+        dates = pd.to_datetime(values, errors='coerce', format='ISO8601')
+    except (TypeError, ValueError):  # pandas < 2.0 has no ISO8601 format
+        dates = pd.to_datetime(values, errors='coerce')
+    # pandas 3 infers the unit from the strings; a column without microseconds
+    # would reject later timestamps that have them
+    return dates.astype('datetime64[ns]')
+
+
+class MatchLog:
+    """Append-only, columnar match history.
+
+    Players are stored as int32 ids (their row in the Players table), the
+    winner as int8 and the date as int64 epoch nanoseconds. Columns grow by
+    doubling, so appends are amortized O(1). A log opened from a snapshot
+    reads straight from the memory-mapped file until its first append.
+    """
+
+    def __init__(self, columns=None, size=0):
+        if columns is None:
+            columns = {name: np.empty(0, dtype=MATCH_DTYPE[name]) for name in MATCH_DTYPE.names}
+        self._columns = columns
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns, including room reserved for appends"""
+        return sum(column.nbytes for column in self._columns.values())
+
+    def column(self, name):
+        """Read-only view of one column"""
+        view = self._columns[name][:self._size].view()
+        view.flags.writeable = False
+        return view
+
+    def player_ids(self):
+        """(matches, 4) int32 array of player ids in seat order"""
+        return np.stack([self._columns[name][:self._size] for name in SEAT_COLUMNS], axis=1)
+
+    def append(self, date, ids, winner, match_id=''):
+        """Append one match; `date` is a datetime, `ids` the four player ids in seat order"""
+        self._reserve(self._size + 1)
+        row = self._size
+        self._columns['date'][row] = pd.Timestamp(date).value
+        for name, player_id in zip(SEAT_COLUMNS, ids):
+            self._columns[name][row] = player_id
+        self._columns['winner'][row] = winner
+        self._columns['match_id'][row] = match_id.encode('ascii')
+        self._size += 1
+
+    def take(self, rows):
+        """New MatchLog holding the given rows, in the given order"""
+        return MatchLog({name: self._columns[name][:self._size][rows] for name in MATCH_DTYPE.names}, len(rows))
+
+    def extend(self, other):
+        """Append every match of another MatchLog, whose ids must refer to the same players"""
+        start = self._size
+        self._reserve(start + len(other))
+        for name in MATCH_DTYPE.names:
+            self._columns[name][start:start + len(other)] = other.column(name)
+        self._size += len(other)
+
+    def _reserve(self, size):
+        capacity = len(self._columns['date'])
+        if size <= capacity and all(column.flags.writeable for column in self._columns.values()):
+            return
+        capacity = max(size, 2 * capacity, 64)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=MATCH_DTYPE[name])
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    @classmethod
+    def from_frame(cls, matches, player_ids):
+        """Encode a DataFrame with the Sheets match columns; names are mapped through player_ids"""
+        columns = {
+            'date': parse_dates(matches['date']).to_numpy(dtype='datetime64[ns]').view('i8'),
+            'winner': pd.to_numeric(matches['winner'], errors='coerce').fillna(0).to_numpy(dtype='i1'),
+            'match_id': (matches['match_id'].fillna('').astype(str).to_numpy(dtype='S32')
+                         if 'match_id' in matches else np.zeros(len(matches), dtype='S32')),
+        }
+        for name in SEAT_COLUMNS:
+            columns[name] = matches[name].map(player_ids).to_numpy(dtype='i4')
+        return cls({name: np.ascontiguousarray(columns[name]) for name in MATCH_DTYPE.names}, len(matches))
+
+    def to_frame(self, names, start=0, stop=None):
+        """Decode rows [start, stop) into a DataFrame with player names and Timestamps"""
+        names = np.asarray(names, dtype=object)
+        stop = self._size if stop is None else min(stop, self._size)
+        frame = {'date': pd.to_datetime(self._columns['date'][start:stop])}
+        for name in SEAT_COLUMNS:
+            frame[name] = names[self._columns[name][start:stop]]
+        frame['winner'] = self._columns['winner'][start:stop].astype(int)
+        frame['match_id'] = np.char.decode(self._columns['match_id'][start:stop], 'ascii').astype(object)
+        return pd.DataFrame(frame)
+
+    def save(self, path):
+        """Atomically write a snapshot that load() can memory-map"""
+        records = np.empty(self._size, dtype=MATCH_DTYPE)
+        for name in MATCH_DTYPE.names:
+            records[name] = self._columns[name][:self._size]
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Open a snapshot without parsing or copying it"""
+        records = np.load(path, mmap_mode='r')
+        if records.dtype != MATCH_DTYPE:
+            raise ValueError(f"Snapshot {path} has an outdated layout")
+        return cls({name: records[name] for name in MATCH_DTYPE.names}, len(records))
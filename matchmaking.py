@@ -0,0 +1,95 @@
+"""Balanced 2v2 matchmaking from a pool of present players.
+
+Every way to form two teams from the pool is scored with the win
+probability the OpenSkill model predicts. The splits closest to 50:50
+are suggested.
+"""
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+from instrumentation import timed
+from league import get_league
+from rating_system import get_model
+
+# Pools up to this size compare every pair of teams; larger ones only compare
+# each team with the teams closest to it in summed mu
+EXHAUSTIVE_POOL_SIZE = 24
+NEIGHBOUR_TEAMS = 64
+
+
+def team_strength(league, first_id, second_id):
+    """(summed mu, summed sigma²) of a two-player team, cached until a member's rating changes"""
+    key = (first_id, second_id) if first_id < second_id else (second_id, first_id)
+    revisions = (league.rating_revision(key[0]), league.rating_revision(key[1]))
+    cached = league.team_strengths.get(key)
+    if cached is not None and cached[0] == revisions:
+        return cached[1]
+
+    players = league.players
+    strength = (
+        float(players.at[key[0], 'mu']) + float(players.at[key[1], 'mu']),
+        float(players.at[key[0], 'sigma']) ** 2 + float(players.at[key[1], 'sigma']) ** 2,
+    )
+    league.team_strengths[key] = (revisions, strength)
+    return strength
+
+
+def _candidate_matches(team_mu, first, second, exhaustive):
+    """Index pairs (p, q) of teams to compare, restricted to teams without a common player"""
+    if exhaustive:
+        p, q = np.triu_indices(len(team_mu), 1)
+    else:
+        # Balanced matches pair teams of similar summed mu, so neighbours in mu order suffice
+        order = np.argsort(team_mu, kind='stable')
+        offsets = range(1, min(NEIGHBOUR_TEAMS, len(order) - 1) + 1)
+        p = np.concatenate([order[:-offset] for offset in offsets])
+        q = np.concatenate([order[offset:] for offset in offsets])
+    disjoint = ((first[p] != first[q]) & (first[p] != second[q])
+                & (second[p] != first[q]) & (second[p] != second[q]))
+    return p[disjoint], q[disjoint]
+
+
+@timed('find_balanced_matches')
+def find_balanced_matches(player_names, limit=3):
+    """Most balanced 2v2 splits of the given players, fairest first.
+
+    Returns dicts with 'team1' and 'team2' name pairs and the model's
+    'team1_win_probability'.
+    """
+    league = get_league()
+    with league.lock:
+        names = list(dict.fromkeys(player_names))
+        ids = [league.player_id(name) for name in names]
+        if len(ids) < 4:
+            return []
+
+        first, second = np.triu_indices(len(ids), 1)
+        strengths = np.array([team_strength(league, ids[i], ids[j])
+                              for i, j in zip(first.tolist(), second.tolist())])
+    team_mu, team_variance = strengths[:, 0], strengths[:, 1]
+
+    p, q = _candidate_matches(team_mu, first, second, len(ids) <= EXHAUSTIVE_POOL_SIZE)
+    # Two-team PlackettLuce prediction: Phi((mu1 - mu2) / sqrt(2 beta² + sum of sigma²))
+    z = (team_mu[p] - team_mu[q]) / np.sqrt(2 * get_model().beta ** 2 + team_variance[p] + team_variance[q])
+
+    best = np.argsort(np.abs(z), kind='stable')[:limit]
+    normal = NormalDist()
+    return [
+        {
+            'team1': (names[first[p[i]]], names[second[p[i]]]),
+            'team2': (names[first[q[i]]], names[second[q[i]]]),
+            'team1_win_probability': normal.cdf(float(z[i])),
+        }
+        for i in best.tolist()
+    ]
+
+
+def win_probability(team1, team2):
+    """Chance that team1 beats team2, each given as two player names"""
+    league = get_league()
+    with league.lock:
+        mu1, variance1 = team_strength(league, *(league.player_id(name) for name in team1))
+        mu2, variance2 = team_strength(league, *(league.player_id(name) for name in team2))
+    return NormalDist().cdf((mu1 - mu2) / math.sqrt(2 * get_model().beta ** 2 + variance1 + variance2))
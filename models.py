@@ -1,15 +1,64 @@
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 from datetime import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 
+from instrumentation import timed
+from league import (DEFAULT_MU, DEFAULT_SIGMA, MATCH_COLUMNS, PLAYER_COLUMNS, TEAM_COLUMNS, get_league,
+                    get_league_cache, pin_league, using_league)
+from match_log import NAT, MatchLog, parse_dates
+from storage import get_storage
+from utils import (build_pair_index, build_player_stats_index, build_recent_matches, push_recent_match,
+                   update_pair_index, update_player_stats_index)
+from write_behind import start_write_behind_queue
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the state snapshot changes, so old snapshots are ignored
+STATE_SNAPSHOT_FORMAT = 2
+
+
+# Initialize the shared league store
+def initialize_data(background=True):
+    """Make the current league current enough to render.
 
-# Initialize session state for data storage
-def initialize_data():
-    if 'players' not in st.session_state:
-        load_data_from_google_sheets()
-        st.cache_data.clear()
+    Sessions share one in-memory league per league id. On a cold start it
+    comes from the local snapshot if there is one, otherwise storage is read
+    in full once; loading a league can evict others that have not been used
+    for a while. After that storage is only polled for what other writers
+    appended, on a background thread unless `background` is False.
+    """
+    league = get_league()
+    loaded = False
+    with league.lock:
+        if league.loaded_at is None:
+            # A restored snapshot can be behind storage, so catch up right away
+            needs_sync = restore_state_snapshot()
+            if not needs_sync:
+                load_data_from_storage()
+                save_state_snapshot()
+            st.cache_data.clear()
+            loaded = True
+        else:
+            needs_sync = league.is_stale()
+    # Whatever the cache evicts, this run keeps working on the league it loaded
+    pin_league(league)
+    if loaded:
+        get_league_cache().trim(keep=league.league_id)
+    if not needs_sync:
+        return
+    if background:
+        sync_in_background()
+    else:
+        sync_from_storage()
     # if 'players' not in st.session_state:
     #     st.session_state.players = pd.DataFrame(columns=[
     #         'name', 'mu', 'sigma', 'created_at', 'last_played'
@@ -20,124 +69,540 @@ def initialize_data():
     #         'team2_player1', 'team2_player2', 'winner'
     #     ])
 
-def initialize_google_sheets():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets.connections.gsheets, scope)
-    client = gspread.authorize(creds)
-    st.cache_data.clear()
-    return client
-
-
 # Player management functions
 def add_player(name):
     """Add a new player with default rating"""
+    league = get_league()
     if name:
-        if st.session_state.players.empty:
-            # Directly add the player if the DataFrame is empty
-            new_player = pd.DataFrame({
-                'name': [name],
-                'mu': [25.0],  # Default OpenSkill mu value
-                'sigma': [8.333],  # Default OpenSkill sigma value
-                'created_at': [datetime.now()],
-                'last_played': [None]
-            })
-            st.session_state.players = pd.concat([st.session_state.players, new_player],
-                                                 ignore_index=True)
-            del st.session_state.sorted_players
-            save_data()
-            return True
-        elif 'name' in st.session_state.players.columns and not any(
-                st.session_state.players['name'] == name):
-            # Add the player if the name does not already exist
-            new_player = pd.DataFrame({
-                'name': [name],
-                'mu': [25.0],  # Default OpenSkill mu value
-                'sigma': [8.333],  # Default OpenSkill sigma value
-                'created_at': [datetime.now()],
-                'last_played': [None]
-            })
-            st.session_state.players = pd.concat([st.session_state.players, new_player],
-                                                 ignore_index=True)
-            del st.session_state.sorted_players
-            save_data()
-            return True
+        with league.lock:
+            return _add_player(league, name)
     return False
 
+def _add_player(league, name):
+    # Skip names that already exist
+    if name in league.player_ids:
+        return False
+
+    add_players_unsaved([name])
+    save_data()
+    return True
+
+def add_players_unsaved(names):
+    """Append new players with the default rating in one step, without saving.
+
+    Names must be new; call with the league lock held and save_data() afterwards.
+    """
+    league = get_league()
+    if not names:
+        return
+    league.players = pd.concat([league.players, _new_players(list(names))], ignore_index=True)
+    league.sync_player_registry()
+    league.bump_version(ratings=True)
+
+def _new_players(names):
+    return pd.DataFrame({
+        'name': names,
+        'mu': [DEFAULT_MU] * len(names),
+        'sigma': [DEFAULT_SIGMA] * len(names),
+        'created_at': [datetime.now()] * len(names),
+        'last_played': [None] * len(names)
+    })
+
 def get_all_players():
     """Return all players sorted by name"""
-    if 'sorted_players' not in st.session_state:
-        if len(st.session_state.players) > 0:
-            st.session_state.sorted_players = st.session_state.players.sort_values('name')
-        else:
-            st.session_state.sorted_players = st.session_state.players
-    return st.session_state.sorted_players
+    league = get_league()
+
+    def sort_players():
+        if len(league.players) > 0:
+            return league.players.sort_values('name')
+        return league.players
+
+    return league.cached('sorted_players', sort_players)
+
+
+# Dirty-row tracking for delta saves
+def mark_player_dirty(idx):
+    """Flag a player row whose mu/sigma/last_played changed since the last save"""
+    get_league().dirty_players.add(idx)
+
+def mark_all_persisted(rebuild=False):
+    """Record that storage now holds the in-memory data collect_changes() covered"""
+    league = get_league()
+    if rebuild:
+        # A rebuild puts every player at the row of its id
+        league.dirty_players = set()
+        league.player_rows = {idx: idx for idx in range(len(league.players))}
+    else:
+        # Rows of players we appended are only known once their write is done; keep those dirty
+        league.dirty_players = {idx for idx in league.dirty_players
+                                if idx < league.persisted_players and idx not in league.player_rows}
+    league.persisted_players = len(league.players)
+    league.persisted_matches = len(league.matches)
 
 
 # Match management functions
 def record_match(team1_player1, team1_player2, team2_player1, team2_player2, winner):
-    """Record a match result"""
-    new_match = pd.DataFrame({
-        'date': [datetime.now()],
-        'team1_player1': [team1_player1],
-        'team1_player2': [team1_player2],
-        'team2_player1': [team2_player1],
-        'team2_player2': [team2_player2],
-        'winner': [winner]  # 1 for team1, 2 for team2
-    })
+    """Record a match result in memory; call save_data() to persist it"""
+    league = get_league()
+    now = datetime.now()
+    with league.lock:
+        players_to_update = [team1_player1, team1_player2, team2_player1, team2_player2]
+        ids = [league.player_id(player) for player in players_to_update]
 
-    st.session_state.matches = pd.concat([st.session_state.matches, new_match], ignore_index=True)
+        # The id lets sync recognise this match when it reads it back from storage
+        match_id = uuid.uuid4().hex
+        league.matches.append(now, ids, winner, match_id)  # winner: 1 for team1, 2 for team2
+        league.unsynced_ids.add(match_id)
 
-    # Update last_played timestamp for all players
-    players_to_update = [team1_player1, team1_player2, team2_player1, team2_player2]
-    for player in players_to_update:
-        idx = st.session_state.players.index[st.session_state.players['name'] == player][0]
-        st.session_state.players.at[idx, 'last_played'] = datetime.now()
+        # Update last_played timestamp for all players
+        for idx in ids:
+            league.players.at[idx, 'last_played'] = now
+            mark_player_dirty(idx)
 
-    # Save data to Google Sheets only once
-    save_data()
+        # Keep the per-player stats index in step with the match log
+        update_player_stats_index(league.player_stats, team1_player1, team1_player2,
+                                  team2_player1, team2_player2, winner, now)
+        update_pair_index(league.pair_stats, ids, winner)
+        # Matches are recorded with the current time, so this one is the newest
+        push_recent_match(league.recent_matches, now, team1_player1, team1_player2,
+                          team2_player1, team2_player2, winner)
+        league.bump_version()
 
 def save_data():
-    save_data_to_google_sheets()
+    """Hand unsaved changes to the background writer and return immediately"""
+    with get_league().lock:
+        changes = collect_changes()
+        mark_all_persisted()
+    if _has_changes(changes):
+        get_write_queue().submit(changes)
     st.cache_data.clear()
     # st.write(st.session_state)
 
+@st.cache_resource
+def get_write_queue():
+    """Process-wide write-behind queue for storage saves"""
+    return start_write_behind_queue(write_changes, merge_changes)
+
+def pending_writes():
+    """Number of saves still waiting to reach storage"""
+    return get_write_queue().pending()
+
 
 # Data persistence functions
-def save_data_to_google_sheets():
-    client = initialize_google_sheets()
-    players_sheet = client.open_by_url(st.secrets.connections.gsheets.spreadsheet).worksheet("Players")
-    matches_sheet = client.open_by_url(st.secrets.connections.gsheets.spreadsheet).worksheet("Matches")
-
-    # Convert Timestamps to strings
-    players_data = st.session_state.players.copy()
-    if not players_data.empty:
-        players_data['created_at'] = players_data['created_at'].astype(str)
-        players_data['last_played'] = players_data['last_played'].astype(str)
-        # Check if the players sheet is empty and initialize it
-        if players_sheet.row_count == 1 and players_sheet.col_count == 1:
-            players_sheet.update([players_data.columns.values.tolist()])
-        players_sheet.update([players_data.columns.values.tolist()] + players_data.values.tolist())
-
-    matches_data = st.session_state.matches.copy()
-    # Check if the matches data is empty
-    if not matches_data.empty:
-        matches_data['date'] = matches_data['date'].astype(str)
-        # Check if the matches sheet is empty and initialize it
-        if matches_sheet.row_count == 1 and matches_sheet.col_count == 1:
-            matches_sheet.update([matches_data.columns.values.tolist()])
-
-        matches_sheet.update([matches_data.columns.values.tolist()] + matches_data.values.tolist())
-
-def load_data_from_google_sheets():
-    client = initialize_google_sheets()
-    # players_sheet = client.open("wuzzler").worksheet("Players")
-    # matches_sheet = client.open("wuzzler").worksheet("Matches")
-    players_sheet = client.open_by_url(st.secrets.connections.gsheets.spreadsheet).worksheet("Players")
-    matches_sheet = client.open_by_url(st.secrets.connections.gsheets.spreadsheet).worksheet("Matches")
-    
-    players_data = players_sheet.get_all_records(expected_headers=['name', 'mu', 'sigma', 'created_at', 'last_played'])
-    matches_data = matches_sheet.get_all_records(expected_headers=['date', 'team1_player1', 'team1_player2', 'team2_player1', 'team2_player2', 'winner'])
-
-    st.session_state.players = pd.DataFrame(players_data)
-    st.session_state.matches = pd.DataFrame(matches_data)
+def _date_to_cell(value):
+    # Never-played players are stored as 'None', as before dates were parsed on load
+    return str(value) if pd.notna(value) else 'None'
+
+def _players_to_rows(players_data):
+    players_data = players_data.copy()
+    players_data['created_at'] = players_data['created_at'].map(_date_to_cell)
+    players_data['last_played'] = players_data['last_played'].map(_date_to_cell)
+    return players_data.values.tolist()
+
+def _matches_to_rows(matches_data):
+    matches_data = matches_data.copy()
+    matches_data['date'] = matches_data['date'].astype(str)
+    return matches_data.values.tolist()
+
+def _has_changes(changes):
+    return (changes['replace_players'] is not None or changes['replace_matches'] is not None
+            or changes['player_updates'] or changes['player_appends'] or changes['match_appends'])
+
+def collect_changes(rebuild=False):
+    """Snapshot everything not yet saved as a changeset for write_changes().
+
+    New matches and players become appends and dirty player rows become row
+    rewrites, so the changeset stays small however large the league gets.
+    Writers only ever append, even to empty tables, so concurrent writers
+    never overwrite each other's rows. `rebuild` instead replaces both tables
+    with the in-memory league, to repair storage.
+    """
+    league = get_league()
+    changes = {
+        'storage': get_storage(),
+        'league': league,
+        'replace_players': None,
+        'replace_matches': None,
+        'player_updates': {},
+        'player_appends': [],
+        'match_appends': [],
+    }
+
+    players = league.players
+    if rebuild:
+        changes['replace_players'] = _players_to_rows(players)
+        changes['replace_matches'] = _matches_to_rows(league.match_frame())
+        return changes
+
+    # Rows are addressed by where the player is stored, which can differ
+    # from its id when several writers append players
+    persisted_players = league.persisted_players
+    dirty = sorted(idx for idx in league.dirty_players if idx in league.player_rows)
+    if dirty:
+        changes['player_updates'] = {league.player_rows[idx]: row
+                                     for idx, row in zip(dirty, _players_to_rows(players.loc[dirty]))}
+    if len(players) > persisted_players:
+        changes['player_appends'] = _players_to_rows(players.iloc[persisted_players:])
+
+    if len(league.matches) > league.persisted_matches:
+        changes['match_appends'] = _matches_to_rows(league.match_frame(league.persisted_matches))
+
+    return changes
+
+@timed('write_changes')
+def write_changes(changes):
+    """Apply a changeset to its storage backend; safe to call from a background thread"""
+    player_rows = changes['storage'].write(changes)
+    if player_rows:
+        try:
+            learn_player_rows(changes['league'], player_rows)
+        except Exception:
+            # The write itself succeeded and must not be retried; the next sync learns the rows
+            logger.exception("Could not record the rows of appended players")
+
+def learn_player_rows(league, player_rows):
+    """Record where storage put players we appended and save what waited for those rows"""
+    with league.lock:
+        for name, row in player_rows.items():
+            idx = league.player_ids.get(name)
+            if idx is not None:
+                league.player_rows[idx] = row
+        save_addressable_changes(league)
+
+def save_addressable_changes(league):
+    """Queue a save if changed players can be addressed in storage by now"""
+    if any(idx in league.player_rows for idx in league.dirty_players):
+        with using_league(league.league_id):
+            pin_league(league)
+            save_data()
+
+def merge_changes(changesets):
+    """Coalesce queued changesets into as few write_changes() calls as possible"""
+    merged = []
+    for changes in changesets:
+        replaces = changes['replace_players'] is not None or changes['replace_matches'] is not None
+        # Full rewrites must run before anything queued after them, so they start a new group
+        if merged and not replaces and merged[-1]['storage'] is changes['storage']:
+            group = merged[-1]
+            # A later rewrite of the same row supersedes earlier ones
+            group['player_updates'] = {**group['player_updates'], **changes['player_updates']}
+            group['player_appends'] = group['player_appends'] + changes['player_appends']
+            group['match_appends'] = group['match_appends'] + changes['match_appends']
+        else:
+            merged.append(dict(changes))
+    return merged
+
+@timed('save_data_to_storage')
+def save_data_to_storage(rebuild=False):
+    """Synchronously persist everything not yet saved; `rebuild` rewrites storage from memory"""
+    with get_league().lock:
+        write_changes(collect_changes(rebuild))
+        mark_all_persisted(rebuild)
+
+@timed('load_data_from_storage')
+def load_data_from_storage():
+    storage = get_storage()
+    players_data = storage.load_players()
+    matches_data = storage.load_matches()
+
+    league = get_league()
+    with league.lock:
+        players = pd.DataFrame(players_data, columns=PLAYER_COLUMNS)
+        matches = pd.DataFrame(matches_data, columns=MATCH_COLUMNS)
+        matches = matches[~_repeated_matches(matches['match_id'])].reset_index(drop=True)
+        for column in ('created_at', 'last_played'):
+            players[column] = parse_dates(players[column])
+
+        # Every id in the match log must be a Players row: re-add players that only
+        # appear in matches, with the default rating, so they are saved back
+        known = set(players['name'])
+        missing = sorted({name for column in TEAM_COLUMNS for name in matches[column]} - known, key=str)
+
+        league.players = pd.concat([players, _new_players(missing)], ignore_index=True) if missing else players
+        league.sync_player_registry()
+        league.matches = MatchLog.from_frame(matches, league.player_ids)
+        league.player_stats = build_player_stats_index(league.matches, league.player_names())
+        league.pair_stats = build_pair_index(league.matches)
+        league.recent_matches = build_recent_matches(league.matches, league.player_names())
+        # Re-added players are not stored yet, so they count as unsaved
+        league.dirty_players = set()
+        league.player_rows = {idx: idx for idx in range(len(players))}
+        league.persisted_players = len(players)
+        league.persisted_matches = len(league.matches)
+        league.synced_matches = len(matches_data)
+        league.unsynced_ids = set()
+        # Copies: rating updates write into the players' columns in place
+        league.synced_ratings = (league.players['mu'].to_numpy(dtype=float, copy=True),
+                                 league.players['sigma'].to_numpy(dtype=float, copy=True))
+        league.rating_history = None
+        league.loaded_at = time.monotonic()
+        league.touch_ratings()
+        league.bump_version(ratings=True)
     st.cache_data.clear()
+
+@timed('sync_from_storage')
+def sync_from_storage():
+    """Merge what other writers appended since the last load or sync.
+
+    Stored matches are an append-only log in which a row's position is its
+    sequence number. Only rows past league.synced_matches are read. Our own
+    matches are recognised by their match_id, other writers' matches are
+    added to the log. Ratings are replayed from the checkpoint at the last
+    synced row in log order, and our own unsynced matches are re-applied on
+    top, so every writer ends up with the same ratings.
+    """
+    storage = get_storage()
+    league = get_league()
+    # Read without the lock, so sessions keep rendering while storage answers
+    synced_matches = league.synced_matches
+    player_names = storage.player_names()
+    rows = storage.load_matches(synced_matches)
+    snapshot = None
+    with league.lock:
+        if league.synced_matches != synced_matches:
+            # Another sync or a reload merged these rows meanwhile
+            return
+        player_count = len(league.players)
+        _merge_player_rows(league, player_names)
+        if rows:
+            _merge_match_rows(league, rows)
+            league.synced_matches += len(rows)
+        league.loaded_at = time.monotonic()
+        # Rows learned just now and ratings the merge changed are not saved otherwise
+        save_addressable_changes(league)
+        if rows or len(league.players) > player_count:
+            snapshot = take_state_snapshot()
+    # Most polls find nothing new; the others write the files without blocking sessions
+    if snapshot is not None:
+        write_state_snapshot(*snapshot)
+
+def sync_in_background():
+    """Run sync_from_storage() on a daemon thread unless a sync is already running"""
+    league = get_league()
+    with league.lock:
+        if league.syncing:
+            return
+        league.syncing = True
+    threading.Thread(target=_sync_in_background, args=(league,), name='league-sync', daemon=True).start()
+
+def _sync_in_background(league):
+    try:
+        with using_league(league.league_id):
+            pin_league(league)
+            sync_from_storage()
+    except Exception:
+        # Sessions keep the current state; the next stale check retries
+        logger.exception("Sync with storage failed")
+    finally:
+        league.syncing = False
+
+def _merge_player_rows(league, player_names):
+    """Learn the stored row of every player and add players other writers created"""
+    # Sheets returns every cell as text, while loaded names may have become numbers
+    known = {str(name): idx for name, idx in league.player_ids.items()}
+    new_players = {}
+    for row, name in enumerate(player_names):
+        if name in known:
+            league.player_rows[known[name]] = row
+        elif name and name not in new_players:
+            new_players[name] = row
+    if not new_players:
+        return
+
+    # Their ratings come from replaying their matches, starting from the default
+    add_players_unsaved(list(new_players))
+    for name, row in new_players.items():
+        league.player_rows[league.player_ids[name]] = row
+    league.persisted_players = len(league.players)
+
+def _repeated_matches(match_ids, logged=None):
+    """Mask of the matches stored before, earlier in the rows or in the `logged` ids.
+
+    A write retried after storage took it stores its matches twice. Matches
+    recorded before ids existed have none and are always kept.
+    """
+    match_ids = match_ids.fillna('').astype(str)
+    repeated = match_ids.duplicated().to_numpy()
+    if logged is not None and len(logged):
+        repeated = repeated | np.isin(match_ids.to_numpy(dtype='S32'), logged)
+    return repeated & (match_ids != '').to_numpy()
+
+def _merge_match_rows(league, rows):
+    """Apply newly synced match rows, given in sequence order"""
+    # Imported here to avoid a circular import: rating_system builds on this module
+    from rating_system import replay_ratings
+
+    matches = pd.DataFrame(rows, columns=MATCH_COLUMNS)
+    # Our own unsynced matches are in the log already and are recognised below
+    logged = league.matches.column('match_id')
+    logged = logged[~np.isin(logged, np.array(sorted(league.unsynced_ids), dtype='S32'))]
+    matches = matches[~_repeated_matches(matches['match_id'], logged)].reset_index(drop=True)
+    known = {str(name): name for name in league.player_ids}
+    for column in TEAM_COLUMNS:
+        matches[column] = matches[column].map(lambda name: known.get(name, name))
+    # Players appended after we read the player names; their rows are learned next sync
+    unknown = sorted({name for column in TEAM_COLUMNS for name in matches[column]} - set(known.values()), key=str)
+    if unknown:
+        add_players_unsaved(unknown)
+        league.persisted_players = len(league.players)
+
+    own = matches['match_id'].isin(league.unsynced_ids).to_numpy()
+    league.unsynced_ids.difference_update(matches['match_id'][own])
+    synced = MatchLog.from_frame(matches, league.player_ids)
+    foreign = MatchLog.from_frame(matches[~own], league.player_ids)
+
+    # Copies, since they may become the checkpoint
+    current_mu = league.players['mu'].to_numpy(dtype=float, copy=True)
+    current_sigma = league.players['sigma'].to_numpy(dtype=float, copy=True)
+    checkpoint = league.synced_ratings
+    if checkpoint is not None:
+        # New players start from the default rating
+        padding = len(league.players) - len(checkpoint[0])
+        checkpoint = (np.concatenate([checkpoint[0], np.full(padding, DEFAULT_MU)]),
+                      np.concatenate([checkpoint[1], np.full(padding, DEFAULT_SIGMA)]))
+
+    if len(foreign) == 0:
+        # Nobody else wrote: current ratings are already right, only the checkpoint moves
+        if checkpoint is not None:
+            league.synced_ratings = ((current_mu, current_sigma) if not league.unsynced_ids
+                                     else replay_ratings(league.players, synced, initial=checkpoint,
+                                                         in_log_order=True))
+        return
+
+    if checkpoint is None:
+        # After a full replay there is no checkpoint: rate their matches on top of ours
+        mu, sigma = replay_ratings(league.players, foreign, initial=(current_mu, current_sigma),
+                                   history=league.rating_history, in_log_order=True)
+    else:
+        # Our own matches are in the history already, with the ratings they were recorded with
+        mu, sigma = replay_ratings(league.players, synced, initial=checkpoint, history=league.rating_history,
+                                   in_log_order=True, record=~own)
+        league.synced_ratings = (mu.copy(), sigma.copy())
+        pending = league.matches.take(np.flatnonzero(np.isin(
+            league.matches.column('match_id'), np.array(sorted(league.unsynced_ids), dtype='S32'))))
+        if len(pending):
+            mu, sigma = replay_ratings(league.players, pending, initial=(mu, sigma), in_log_order=True)
+    if league.synced_ratings is None and not league.unsynced_ids:
+        league.synced_ratings = (mu.copy(), sigma.copy())
+
+    league.players['mu'] = mu
+    league.players['sigma'] = sigma
+    changed = np.flatnonzero((mu != current_mu) | (sigma != current_sigma)).tolist()
+    for idx in changed:
+        mark_player_dirty(idx)
+    update_last_played(foreign)
+
+    league.matches.extend(foreign)
+    league.persisted_matches = len(league.matches)
+    names = league.player_names()
+    for ids, winner, date in zip(foreign.player_ids().tolist(), foreign.column('winner').tolist(),
+                                 foreign.column('date').tolist()):
+        update_player_stats_index(league.player_stats, *(names[idx] for idx in ids), winner,
+                                  None if date == NAT else pd.Timestamp(date))
+        update_pair_index(league.pair_stats, ids, winner)
+    league.recent_matches = build_recent_matches(league.matches, names)
+    league.touch_ratings(changed)
+    league.bump_version(ratings=True)
+
+def update_last_played(match_log):
+    """Move players' last_played forward to their latest match in match_log"""
+    league = get_league()
+    latest = np.full(len(league.players), NAT)
+    np.maximum.at(latest, match_log.player_ids().ravel(), np.repeat(match_log.column('date'), 4))
+    for idx in np.flatnonzero(latest != NAT).tolist():
+        played = pd.Timestamp(latest[idx])
+        current = league.players.at[idx, 'last_played']
+        if pd.isna(current) or played > current:
+            league.players.at[idx, 'last_played'] = played
+            mark_player_dirty(idx)
+
+def save_state_snapshot():
+    """Write the local warm-start snapshot of the league as of the last sync"""
+    snapshot = take_state_snapshot()
+    if snapshot is not None:
+        write_state_snapshot(*snapshot)
+
+def take_state_snapshot():
+    """The current league's warm-start snapshot, taken under its lock and written by write_state_snapshot().
+
+    None while our own matches or new players are not confirmed in storage
+    yet, so a restored league never holds what storage may have lost.
+    """
+    league = get_league()
+    if league.unsynced_ids or len(league.player_rows) < len(league.players):
+        return None
+    match_ids = league.matches.column('match_id')
+    state = {
+        'format': STATE_SNAPSHOT_FORMAT,
+        'location': get_storage().location,
+        'match_count': len(league.matches),
+        'last_match_id': match_ids[-1] if len(match_ids) else None,
+        'players': league.players,
+        'player_stats': league.player_stats,
+        'pair_stats': league.pair_stats,
+        'recent_matches': league.recent_matches,
+        'dirty_players': league.dirty_players,
+        'player_rows': league.player_rows,
+        'synced_matches': league.synced_matches,
+        'synced_ratings': league.synced_ratings,
+        'rating_history': league.rating_history,
+    }
+    # Copies: sessions keep changing the league once the lock is released
+    return (league, league.matches.take(np.arange(len(league.matches))),
+            pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+def write_state_snapshot(league, matches, state):
+    """Write the files of a snapshot from take_state_snapshot(); needs no lock"""
+    try:
+        matches.save(league.match_snapshot_path)
+        directory = os.path.dirname(os.path.abspath(league.state_snapshot_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.pkl')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(state)
+        os.replace(tmp_path, league.state_snapshot_path)
+    except OSError:
+        # The snapshot is only a cache; a read-only or full disk must not break syncs
+        pass
+
+def restore_state_snapshot():
+    """Load the league from its local snapshot; False if there is none for this storage"""
+    league = get_league()
+    try:
+        with open(league.state_snapshot_path, 'rb') as f:
+            state = pickle.load(f)
+    except Exception:
+        # Missing, truncated or written by other library versions: start cold
+        return False
+    matches = load_match_snapshot(league.match_snapshot_path)
+    if (not isinstance(state, dict) or state.get('format') != STATE_SNAPSHOT_FORMAT
+            or state['location'] != get_storage().location
+            or matches is None or len(matches) != state['match_count']
+            or (len(matches) and matches.column('match_id')[-1] != state['last_match_id'])):
+        return False
+
+    with league.lock:
+        league.players = state['players']
+        league.sync_player_registry()
+        league.matches = matches
+        league.player_stats = state['player_stats']
+        league.pair_stats = state['pair_stats']
+        league.recent_matches = state['recent_matches']
+        league.dirty_players = state['dirty_players']
+        league.player_rows = state['player_rows']
+        league.persisted_players = len(league.players)
+        league.persisted_matches = len(matches)
+        league.synced_matches = state['synced_matches']
+        league.unsynced_ids = set()
+        league.synced_ratings = state['synced_ratings']
+        league.rating_history = state['rating_history']
+        league.loaded_at = time.monotonic()
+        league.touch_ratings()
+        league.bump_version(ratings=True)
+    return True
+
+def load_match_snapshot(path):
+    """Memory-map a local match log snapshot, or None if there is none"""
+    try:
+        return MatchLog.load(path)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,114 @@
+from array import array
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+# Per entry: match date as epoch nanoseconds, the player's rating before and after the match
+HISTORY_FIELDS = ('date', 'mu_before', 'sigma_before', 'mu_after', 'sigma_after')
+_TYPECODES = {'date': 'q', 'mu_before': 'd', 'sigma_before': 'd', 'mu_after': 'd', 'sigma_after': 'd'}
+
+
+def _empty_history():
+    return {name: array(_TYPECODES[name]) for name in HISTORY_FIELDS}
+
+
+class RatingHistory:
+    """Append-only rating changes per player, each player's sorted by match date.
+
+    Every player's entries live in their own typed arrays (8 bytes per value),
+    so "rating at time T" is a binary search over that player's dates.
+    Entries with equal dates keep the order they were rated in.
+    """
+
+    def __init__(self):
+        # player id -> field -> array
+        self._players = {}
+
+    def __len__(self):
+        return sum(len(history['date']) for history in self._players.values())
+
+    @property
+    def nbytes(self):
+        return sum(len(values) * values.itemsize for history in self._players.values() for values in history.values())
+
+    def record(self, date, ratings):
+        """Add one match; `ratings` holds (player id, mu before, sigma before, mu after, sigma after)"""
+        date = int(date)
+        for player_id, mu_before, sigma_before, mu_after, sigma_after in ratings:
+            history = self._players.setdefault(player_id, _empty_history())
+            position = bisect_right(history['date'], date)
+            for name, value in zip(HISTORY_FIELDS, (date, mu_before, sigma_before, mu_after, sigma_after)):
+                history[name].insert(position, value)
+
+    def extend(self, dates, ids, mu_after, sigma_after, initial_mu, initial_sigma, keep=None):
+        """Add matches rated in order from (initial_mu, initial_sigma).
+
+        `dates` holds one date per match, `ids` the four player ids per match
+        and `mu_after`/`sigma_after` the four players' ratings after it. A
+        player's rating before a match is the one after their previous match
+        here, or their initial rating. With the boolean mask `keep`, only
+        those matches are added, though all of them count for the ratings
+        before the next.
+        """
+        if len(dates) == 0:
+            return
+        players = ids.ravel()
+        entry_dates = np.repeat(np.asarray(dates, dtype=np.int64), ids.shape[1])
+        # Group entries by player, keeping rating order within each player
+        order = np.argsort(players, kind='stable')
+        players, entry_dates = players[order], entry_dates[order]
+        mu_after, sigma_after = mu_after.ravel()[order], sigma_after.ravel()[order]
+
+        starts = np.flatnonzero(np.r_[True, players[1:] != players[:-1]])
+        mu_before = np.r_[np.nan, mu_after[:-1]]
+        sigma_before = np.r_[np.nan, sigma_after[:-1]]
+        mu_before[starts] = initial_mu[players[starts]]
+        sigma_before[starts] = initial_sigma[players[starts]]
+
+        if keep is not None:
+            kept = np.repeat(np.asarray(keep, dtype=bool), ids.shape[1])[order]
+            players, entry_dates = players[kept], entry_dates[kept]
+            mu_before, sigma_before = mu_before[kept], sigma_before[kept]
+            mu_after, sigma_after = mu_after[kept], sigma_after[kept]
+            if len(players) == 0:
+                return
+            starts = np.flatnonzero(np.r_[True, players[1:] != players[:-1]])
+
+        columns = {'date': entry_dates, 'mu_before': mu_before, 'sigma_before': sigma_before,
+                   'mu_after': mu_after, 'sigma_after': sigma_after}
+        for start, stop in zip(starts.tolist(), np.r_[starts[1:], len(players)].tolist()):
+            history = self._players.setdefault(int(players[start]), _empty_history())
+            group_dates = entry_dates[start:stop]
+            if (len(history['date']) and group_dates[0] < history['date'][-1]) or np.any(np.diff(group_dates) < 0):
+                # Out of date order: insert one by one
+                for offset in range(start, stop):
+                    position = bisect_right(history['date'], int(entry_dates[offset]))
+                    for name in HISTORY_FIELDS:
+                        history[name].insert(position, columns[name][offset].item())
+            else:
+                for name in HISTORY_FIELDS:
+                    history[name].frombytes(np.ascontiguousarray(columns[name][start:stop],
+                                                                 dtype=_TYPECODES[name]).tobytes())
+
+    def rating_at(self, player_id, date):
+        """(mu, sigma) after the player's last match at or before `date`.
+
+        Before their first match this is the rating they started with; None
+        for players without matches.
+        """
+        history = self._players.get(player_id)
+        if not history or not len(history['date']):
+            return None
+        position = bisect_right(history['date'], int(pd.Timestamp(date).value))
+        if position == 0:
+            return history['mu_before'][0], history['sigma_before'][0]
+        return history['mu_after'][position - 1], history['sigma_after'][position - 1]
+
+    def frame(self, player_id):
+        """A player's history as a DataFrame, oldest first"""
+        history = self._players.get(player_id, _empty_history())
+        # Copies: a NumPy view would keep the arrays from growing
+        frame = pd.DataFrame({name: np.array(history[name], dtype=_TYPECODES[name]) for name in HISTORY_FIELDS})
+        frame['date'] = frame['date'].astype('datetime64[ns]')
+        return frame
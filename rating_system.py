@@ -1,23 +1,42 @@
-from openskill.models import PlackettLuce
+import functools
+import math
+
+import numpy as np
 import pandas as pd
-import streamlit as st
 
-model = PlackettLuce()
+from instrumentation import timed
+from league import DEFAULT_MU, DEFAULT_SIGMA, TEAM_COLUMNS, get_league
+from match_log import MatchLog
+from models import mark_player_dirty, record_match, save_data
+from rating_history import RatingHistory
+from utils import get_window_counts
+
+@functools.lru_cache(maxsize=None)
+def get_model():
+    """The OpenSkill model, imported on first use so the app starts without it"""
+    from openskill.models import PlackettLuce
+    return PlackettLuce()
 
 # Configure OpenSkill with TrueSkill algorithm
 
-def update_ratings(team1_player1, team1_player2, team2_player1, team2_player2, winner):
-    """Update player ratings based on match result"""
+@timed('calculate_new_ratings')
+def calculate_new_ratings(team1_player1, team1_player2, team2_player1, team2_player2, winner):
+    """Compute post-match ratings without touching any state.
+
+    Returns a list of (row index, mu, sigma) for the four participants.
+    """
     # Get current ratings
-    players_df = st.session_state.players
+    league = get_league()
+    players_df = league.players
 
     # Find player ratings
-    t1p1_idx = players_df.index[players_df['name'] == team1_player1][0]
-    t1p2_idx = players_df.index[players_df['name'] == team1_player2][0]
-    t2p1_idx = players_df.index[players_df['name'] == team2_player1][0]
-    t2p2_idx = players_df.index[players_df['name'] == team2_player2][0]
+    t1p1_idx = league.player_id(team1_player1)
+    t1p2_idx = league.player_id(team1_player2)
+    t2p1_idx = league.player_id(team2_player1)
+    t2p2_idx = league.player_id(team2_player2)
 
     # Create rating objects
+    model = get_model()
     t1p1_rating = model.rating(mu=players_df.at[t1p1_idx, 'mu'], 
                                    sigma=players_df.at[t1p1_idx, 'sigma'])
     t1p2_rating = model.rating(mu=players_df.at[t1p2_idx, 'mu'], 
@@ -41,18 +60,246 @@ def update_ratings(team1_player1, team1_player2, team2_player1, team2_player2, w
     new_t1p1, new_t1p2 = new_ratings[0]
     new_t2p1, new_t2p2 = new_ratings[1]
 
-    # Update dataframe
-    players_df.at[t1p1_idx, 'mu'] = new_t1p1.mu
-    players_df.at[t1p1_idx, 'sigma'] = new_t1p1.sigma
+    return [
+        (t1p1_idx, new_t1p1.mu, new_t1p1.sigma),
+        (t1p2_idx, new_t1p2.mu, new_t1p2.sigma),
+        (t2p1_idx, new_t2p1.mu, new_t2p1.sigma),
+        (t2p2_idx, new_t2p2.mu, new_t2p2.sigma),
+    ]
+
+def apply_ratings(new_ratings):
+    """Write ratings from calculate_new_ratings into the players DataFrame"""
+    league = get_league()
+    with league.lock:
+        for idx, mu, sigma in new_ratings:
+            league.players.at[idx, 'mu'] = mu
+            league.players.at[idx, 'sigma'] = sigma
+            # Only these rows need rewriting on the next save
+            mark_player_dirty(idx)
+        league.touch_ratings([idx for idx, _, _ in new_ratings])
+        league.bump_version(ratings=True)
+
+@timed('update_ratings')
+def update_ratings(team1_player1, team1_player2, team2_player1, team2_player2, winner):
+    """Update player ratings based on match result"""
+    apply_ratings(calculate_new_ratings(team1_player1, team1_player2,
+                                        team2_player1, team2_player2, winner))
+
+@timed('record_match_result')
+def record_match_result(team1_player1, team1_player2, team2_player1, team2_player2, winner):
+    """Record a match, rate it and persist both with a single save"""
+    league = get_league()
+    # Hold the league lock so no other session sees the match without its ratings
+    with league.lock:
+        # Rate first: if anything fails here, neither the match nor the ratings are applied
+        new_ratings = calculate_new_ratings(team1_player1, team1_player2,
+                                            team2_player1, team2_player2, winner)
+        record_match(team1_player1, team1_player2, team2_player1, team2_player2, winner)
+        if league.rating_history is not None:
+            # record_match appended the match last
+            players = league.players
+            league.rating_history.record(league.matches.column('date')[-1], [
+                (idx, players.at[idx, 'mu'], players.at[idx, 'sigma'], mu, sigma) for idx, mu, sigma in new_ratings
+            ])
+        apply_ratings(new_ratings)
+        save_data()
+
+# Full-history replay
+# Below this many matches per conflict-free wave, NumPy call overhead outweighs vectorization
+MIN_WAVE_WIDTH = 64
+
+def _encode_matches(matches, in_log_order=False):
+    """Turn a MatchLog into chronological (ids, team1_won, dates, order) arrays, or keep log order.
+
+    `order` indexes log-ordered per-match arrays into the returned order.
+    """
+    ids = matches.player_ids()
+    team1_won = matches.column('winner') == 1
+    dates = matches.column('date')
+    if in_log_order:
+        return ids, team1_won, dates, slice(None)
+
+    # Stable sort keeps log order for matches with equal timestamps
+    order = np.argsort(dates.view('datetime64[ns]'), kind='stable')
+    return ids[order], team1_won[order], dates[order], order
+
+def _match_log_from_frame(players, matches):
+    player_ids = {name: idx for idx, name in enumerate(players['name'])}
+    unknown = set(matches[TEAM_COLUMNS].to_numpy().ravel()) - set(player_ids)
+    if unknown:
+        raise ValueError(f"Matches reference unknown players: {sorted(unknown, key=str)}")
+    return MatchLog.from_frame(matches, player_ids)
+
+def _assign_waves(ids, player_count):
+    """Group matches into waves in which no player appears twice.
+
+    A match goes into the wave after the latest wave of any of its players, so
+    applying waves in order applies every player's matches in order.
+    """
+    last_wave = [-1] * player_count
+    waves = np.empty(len(ids), dtype=np.int64)
+    for i, (a, b, c, d) in enumerate(ids.tolist()):
+        wave = max(last_wave[a], last_wave[b], last_wave[c], last_wave[d]) + 1
+        last_wave[a] = last_wave[b] = last_wave[c] = last_wave[d] = wave
+        waves[i] = wave
+    return waves
+
+# Seat layout of the id arrays: team 1 is seats 0-1, team 2 is seats 2-3
+SEAT_SIGN = np.array([1.0, 1.0, -1.0, -1.0])
+PARTNER = [1, 0, 3, 2]
+
+def _rate_wave(mu, sigma, ids, team1_won):
+    """Vectorized 2v2 PlackettLuce update for matches with disjoint players"""
+    model = get_model()
+    player_mu = mu[ids]
+    sigma_squared = sigma[ids] ** 2 + model.tau ** 2
+    team_sigma_squared = sigma_squared + sigma_squared[:, PARTNER]
+    c = np.sqrt(sigma_squared.sum(axis=1) + 2 * model.beta ** 2)
+
+    # With two teams, both teams' omega equals +/- the chance that the loser would have won
+    outcome = np.where(team1_won, 1.0, -1.0)
+    upset = 1 / (1 + np.exp(outcome * (player_mu @ SEAT_SIGN) / c))
+
+    mu[ids] = player_mu + sigma_squared * (outcome * upset / c)[:, None] * SEAT_SIGN
+    shrink = sigma_squared * np.sqrt(team_sigma_squared) * (upset * (1 - upset) / c ** 3)[:, None]
+    sigma[ids] = np.sqrt(sigma_squared * np.maximum(1 - shrink, model.kappa))
+
+def _rate_sequential(mu, sigma, ids, team1_won, trace=False):
+    """Same update as _rate_wave, one match at a time on plain floats.
+
+    With `trace`, returns the four players' (mu..., sigma...) after every match.
+    """
+    model = get_model()
+    beta_squared_2 = 2 * model.beta ** 2
+    tau_squared = model.tau ** 2
+    kappa = model.kappa
+    exp, sqrt = math.exp, math.sqrt
+    mu_list = mu.tolist()
+    sigma_list = sigma.tolist()
+    after = [] if trace else None
 
-    players_df.at[t1p2_idx, 'mu'] = new_t1p2.mu
-    players_df.at[t1p2_idx, 'sigma'] = new_t1p2.sigma
+    for (a, b, c_, d), won in zip(ids.tolist(), team1_won.tolist()):
+        sa = sigma_list[a] ** 2 + tau_squared
+        sb = sigma_list[b] ** 2 + tau_squared
+        sc = sigma_list[c_] ** 2 + tau_squared
+        sd = sigma_list[d] ** 2 + tau_squared
+        team1_sigma_squared = sa + sb
+        team2_sigma_squared = sc + sd
+        c = sqrt(team1_sigma_squared + team2_sigma_squared + beta_squared_2)
+        margin = (mu_list[a] + mu_list[b] - mu_list[c_] - mu_list[d]) / c
+        if won:
+            upset = 1 / (1 + exp(margin))
+            step = upset / c
+        else:
+            upset = 1 / (1 + exp(-margin))
+            step = -upset / c
+        variance_step = upset * (1 - upset) / c ** 3
+        shrink1 = variance_step * sqrt(team1_sigma_squared)
+        shrink2 = variance_step * sqrt(team2_sigma_squared)
 
-    players_df.at[t2p1_idx, 'mu'] = new_t2p1.mu
-    players_df.at[t2p1_idx, 'sigma'] = new_t2p1.sigma
+        mu_list[a] += sa * step
+        mu_list[b] += sb * step
+        mu_list[c_] -= sc * step
+        mu_list[d] -= sd * step
+        factor_a = 1 - sa * shrink1
+        factor_b = 1 - sb * shrink1
+        factor_c = 1 - sc * shrink2
+        factor_d = 1 - sd * shrink2
+        sigma_list[a] = sqrt(sa * (factor_a if factor_a > kappa else kappa))
+        sigma_list[b] = sqrt(sb * (factor_b if factor_b > kappa else kappa))
+        sigma_list[c_] = sqrt(sc * (factor_c if factor_c > kappa else kappa))
+        sigma_list[d] = sqrt(sd * (factor_d if factor_d > kappa else kappa))
+        if trace:
+            after.append((mu_list[a], mu_list[b], mu_list[c_], mu_list[d],
+                          sigma_list[a], sigma_list[b], sigma_list[c_], sigma_list[d]))
 
-    players_df.at[t2p2_idx, 'mu'] = new_t2p2.mu
-    players_df.at[t2p2_idx, 'sigma'] = new_t2p2.sigma
+    mu[:] = mu_list
+    sigma[:] = sigma_list
+    return np.array(after, dtype=float).reshape(-1, 8) if trace else None
+
+@timed('replay_ratings')
+def replay_ratings(players=None, matches=None, initial=None, history=None, in_log_order=False, record=None):
+    """Recompute every player's rating from the match log in chronological order.
+
+    Returns (mu, sigma) NumPy arrays aligned with the rows of the players
+    DataFrame. Players start at the default rating, as in add_player, or at
+    the (mu, sigma) arrays in `initial` to continue from existing ratings.
+    `matches` is a MatchLog or a DataFrame with the Sheets match columns.
+    Every rating change is also added to the RatingHistory `history`, if given;
+    `record` is a boolean mask of the matches to add, by default all of them.
+    With `in_log_order`, matches are rated in the order given instead of by
+    date, as syncs must so every writer rates the stored log the same way.
+    """
+    league = get_league()
+    players = league.players if players is None else players
+    matches = league.matches if matches is None else matches
+    if isinstance(matches, pd.DataFrame):
+        matches = _match_log_from_frame(players, matches)
+
+    if initial is None:
+        mu = np.full(len(players), DEFAULT_MU)
+        sigma = np.full(len(players), DEFAULT_SIGMA)
+    else:
+        mu = np.array(initial[0], dtype=float)
+        sigma = np.array(initial[1], dtype=float)
+    if len(matches) == 0:
+        return mu, sigma
+
+    ids, team1_won, dates, rated_order = _encode_matches(matches, in_log_order)
+    if history is not None:
+        initial_mu, initial_sigma = mu.copy(), sigma.copy()
+
+    # A wave holds at most a quarter of the players, so small leagues never get wide waves
+    if len(players) >= 4 * MIN_WAVE_WIDTH:
+        waves = _assign_waves(ids, len(players))
+        wide_waves = len(ids) >= MIN_WAVE_WIDTH * (int(waves.max()) + 1)
+    else:
+        wide_waves = False
+
+    if not wide_waves:
+        # Narrow waves: a tight loop over plain floats beats per-wave NumPy calls
+        after = _rate_sequential(mu, sigma, ids, team1_won, trace=history is not None)
+    else:
+        after = np.empty((len(ids), 8)) if history is not None else None
+        order = np.argsort(waves, kind='stable')
+        boundaries = np.flatnonzero(np.diff(waves[order])) + 1
+        for wave in np.split(order, boundaries):
+            _rate_wave(mu, sigma, ids[wave], team1_won[wave])
+            if after is not None:
+                after[wave, :4] = mu[ids[wave]]
+                after[wave, 4:] = sigma[ids[wave]]
+
+    if history is not None:
+        history.extend(dates, ids, after[:, :4], after[:, 4:], initial_mu, initial_sigma,
+                       keep=None if record is None else np.asarray(record, dtype=bool)[rated_order])
+    return mu, sigma
+
+def get_rating_history():
+    """The league's RatingHistory, replayed from the match log on first use after a reload"""
+    league = get_league()
+    with league.lock:
+        if league.rating_history is None:
+            history = RatingHistory()
+            replay_ratings(history=history)
+            league.rating_history = history
+        return league.rating_history
+
+def rebuild_ratings():
+    """Replace stored ratings with a full replay of the match log and save them"""
+    league = get_league()
+    with league.lock:
+        history = RatingHistory()
+        mu, sigma = replay_ratings(history=history)
+        league.players['mu'] = mu
+        league.players['sigma'] = sigma
+        for idx in league.players.index:
+            mark_player_dirty(idx)
+        league.touch_ratings()
+        # Replayed ratings no longer extend the sync checkpoint
+        league.synced_ratings = None
+        league.rating_history = history
+        league.bump_version(ratings=True)
+        save_data()
 
 def get_display_rating(mu, sigma):
     """Calculate display rating (mu - 3*sigma)"""
@@ -73,19 +320,98 @@ def assign_rank(display_rating):
             return rank
     return 'Unranked'
 
-def get_leaderboard():
-    """Return players sorted by rating with ranks if 10 or more matches are played"""
-    if len(st.session_state.players) == 0:
+# RANK_THRESHOLDS as ascending bin edges; bin -1 (below every threshold) is 'Unranked'
+_RANK_EDGES = np.array(sorted(RANK_THRESHOLDS.values()), dtype=float)
+_RANK_LABELS = np.array(sorted(RANK_THRESHOLDS, key=RANK_THRESHOLDS.get) + ['Unranked'], dtype=object)
+
+def assign_ranks(display_ratings):
+    """Vectorized assign_rank for an array of display ratings"""
+    display_ratings = np.asarray(display_ratings, dtype=float)
+    bins = np.searchsorted(_RANK_EDGES, display_ratings, side='right') - 1
+    # NaN sorts past every edge but fails every threshold, as in assign_rank
+    bins[np.isnan(display_ratings)] = -1
+    return _RANK_LABELS[bins]
+
+# Matches a player needs in total before they get a rank
+RANKED_MIN_MATCHES = 10
+
+# Leaderboard periods offered in the app; seasons are calendar quarters
+LEADERBOARD_PERIODS = ['All Time', 'This Week', 'This Month', 'This Season', 'Last 30 Days']
+
+def period_start(period, now=None):
+    """Start of a leaderboard period, or None for all time"""
+    # Periods start at midnight, so their leaderboards stay cached for the day
+    today = (pd.Timestamp.now() if now is None else pd.Timestamp(now)).normalize()
+    if period == 'All Time':
+        return None
+    if period == 'This Week':
+        return today - pd.Timedelta(days=today.weekday())
+    if period == 'This Month':
+        return today.replace(day=1)
+    if period == 'This Season':
+        return today.replace(month=3 * ((today.month - 1) // 3) + 1, day=1)
+    if period == 'Last 30 Days':
+        return today - pd.Timedelta(days=30)
+    raise ValueError(f"Unknown leaderboard period: {period}")
+
+@timed('get_leaderboard')
+def get_leaderboard(period='All Time'):
+    """Return players sorted by rating with their matches and wins in a LEADERBOARD_PERIODS period.
+
+    For All Time the counts are all-time; for other periods only players who
+    played since period_start() are listed. Players are ranked once they
+    played RANKED_MIN_MATCHES matches in total. The result is shared between
+    sessions and reruns until ratings or matches change or a new period
+    starts; copy it before modifying it.
+    """
+    league = get_league()
+    start = period_start(period)
+    # One entry per period: the start is part of the version, so yesterday's entry is replaced
+    return league.cached(('leaderboard', period),
+                         lambda: _compute_leaderboard(league.players, start),
+                         version=(league.ratings_version, len(league.matches), start))
+
+def _compute_leaderboard(players, start):
+    if len(players) == 0:
         return pd.DataFrame()
 
-    leaderboard = st.session_state.players.copy()
-    leaderboard['display_rating'] = leaderboard.apply(
-        lambda x: get_display_rating(x['mu'], x['sigma']), axis=1
+    matches, wins = get_window_counts(start)
+    windowed = start is not None
+    total_matches = get_window_counts()[0] if windowed else matches
+
+    display_rating = get_display_rating(players['mu'].astype(float), players['sigma'].astype(float))
+    leaderboard = players.assign(
+        display_rating=display_rating,
+        rank=np.where(total_matches >= RANKED_MIN_MATCHES, assign_ranks(display_rating), 'Unranked'),
+        matches=matches,
+        wins=wins,
     )
+    if windowed:
+        leaderboard = leaderboard[matches > 0]
+    return leaderboard.sort_values('display_rating', ascending=False)
 
-    if len(st.session_state.matches) >= 10:
-        leaderboard['rank'] = leaderboard['display_rating'].apply(assign_rank)
-    else:
-        leaderboard['rank'] = 'Unranked'
+def get_rating_at(player_name, date):
+    """A player's (mu, sigma) as of `date`, or None if they have no rated matches"""
+    league = get_league()
+    history = get_rating_history()
+    with league.lock:
+        return history.rating_at(league.player_id(player_name), date)
 
-    return leaderboard.sort_values('display_rating', ascending=False)
\ No newline at end of file
+@timed('get_rating_curves')
+def get_rating_curves(player_names):
+    """Display rating after every match of each player, one column per player, for charting"""
+    league = get_league()
+    history = get_rating_history()
+    curves = {}
+    with league.lock:
+        for name in player_names:
+            frame = history.frame(league.player_id(name))
+            curve = pd.Series(get_display_rating(frame['mu_after'], frame['sigma_after']).to_numpy(),
+                              index=frame['date'])
+            curve = curve[curve.index.notna()]
+            if len(curve):
+                curves[name] = curve[~curve.index.duplicated(keep='last')]
+    if not curves:
+        return pd.DataFrame()
+    # A rating holds until the player's next match
+    return pd.concat(curves, axis=1).sort_index().ffill()
@@ -0,0 +1,343 @@
+"""Storage backends the league is persisted to.
+
+A backend loads the Players and Matches tables and applies changesets built
+by models.collect_changes(). Players are addressed by row, 0-based, in the
+order they were stored. Matches are an append-only log in which a row's
+position is its sequence number. Changesets look like:
+
+    {
+        'storage': backend that collected them,
+        'league': League they were collected from,
+        'replace_players': all player rows, or None,  # explicit rebuilds only
+        'replace_matches': all match rows, or None,   # explicit rebuilds only
+        'player_updates': {player row: row values},
+        'player_appends': [row values, ...],
+        'match_appends': [row values, ...],
+    }
+
+Set WUZZLER_SQLITE to a database path to store the league in SQLite instead
+of Google Sheets.
+
+Each league has its own backend. The default league is the spreadsheet in
+st.secrets.connections.gsheets or the WUZZLER_SQLITE database; other leagues
+are the spreadsheets listed by id in a [leagues] secrets table, or SQLite
+databases next to the default one named <name>-<league id>.db.
+"""
+import numbers
+import os
+import sqlite3
+from contextlib import closing
+
+import streamlit as st
+
+from instrumentation import instrument_session, timed
+from league import (DEFAULT_LEAGUE, MATCH_COLUMNS, MATCH_RESULT_COLUMNS, PLAYER_COLUMNS, UnknownLeagueError,
+                    get_league)
+
+
+class StorageBackend:
+    """Interface every backend implements"""
+
+    # Identifies the stored league, so local snapshots of another one are never used
+    location = None
+
+    def load_players(self):
+        """All player rows as dicts keyed by PLAYER_COLUMNS, in row order"""
+        raise NotImplementedError
+
+    def player_names(self):
+        """Name of every stored player, in row order"""
+        raise NotImplementedError
+
+    def load_matches(self, start=0):
+        """Match rows from sequence number `start` on, as lists in MATCH_COLUMNS order"""
+        raise NotImplementedError
+
+    def write(self, changes):
+        """Apply a changeset at once; returns the row of each appended player it knows, by name"""
+        raise NotImplementedError
+
+
+# Google Sheets
+@st.cache_resource
+@timed('gspread.authorize')
+def get_gspread_client():
+    """Authorize once per process and share the client across sessions.
+
+    gspread wraps the credentials in an AuthorizedSession, which refreshes the
+    access token on expiry and keeps HTTP connections alive between calls.
+    gspread and oauth2client are imported here, on first use, because they
+    take longer to import than the app takes to render.
+    """
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets.connections.gsheets, scope)
+    client = gspread.authorize(creds)
+    # Count every request and its payload for the admin panel
+    instrument_session(client.session)
+    return client
+
+@timed('initialize_google_sheets')
+def initialize_google_sheets():
+    """Return the process-wide gspread client"""
+    return get_gspread_client()
+
+@st.cache_resource
+@timed('gspread.open_by_url')
+def get_spreadsheet():
+    """Open the league spreadsheet once per process"""
+    return initialize_google_sheets().open_by_url(st.secrets.connections.gsheets.spreadsheet)
+
+
+def _cell(value):
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return {'userEnteredValue': {'numberValue': int(value)}}
+    if isinstance(value, numbers.Real):
+        return {'userEnteredValue': {'numberValue': float(value)}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+def _row_data(rows):
+    return [{'values': [_cell(value) for value in row]} for row in rows]
+
+def _update_row_request(worksheet, row_index, row):
+    # Row 1 of the sheet is the header, so player row n lives at sheet row n + 2
+    return {'updateCells': {
+        'range': {
+            'sheetId': worksheet.id,
+            'startRowIndex': row_index + 1,
+            'endRowIndex': row_index + 2,
+            'startColumnIndex': 0,
+            'endColumnIndex': len(row)
+        },
+        'rows': _row_data([row]),
+        'fields': 'userEnteredValue'
+    }}
+
+def _append_rows_request(worksheet, rows):
+    return {'appendCells': {
+        'sheetId': worksheet.id,
+        'rows': _row_data(rows),
+        'fields': 'userEnteredValue'
+    }}
+
+# Last column of the Matches sheet, for reading rows by range
+MATCHES_LAST_COLUMN = chr(ord('A') + len(MATCH_COLUMNS) - 1)
+
+
+class SheetsStorage(StorageBackend):
+    """The Players and Matches worksheets of the league spreadsheet"""
+
+    def __init__(self, spreadsheet=None, url=None):
+        # Opened lazily so constructing the backend needs no network access
+        self._spreadsheet = spreadsheet
+        self._url = url
+        self._worksheets = {}
+        # Titles of worksheets known to start with their header row
+        self._headers = set()
+
+    @property
+    def location(self):
+        if self._url is None:
+            self._url = st.secrets.connections.gsheets.spreadsheet
+        return self._url
+
+    @property
+    def spreadsheet(self):
+        if self._spreadsheet is None:
+            if self._url is None:
+                self._spreadsheet = get_spreadsheet()
+            else:
+                # Opened per backend, so the handle goes when its league is evicted
+                self._spreadsheet = initialize_google_sheets().open_by_url(self._url)
+        return self._spreadsheet
+
+    def worksheet(self, title):
+        """Cached handle for a worksheet of the league spreadsheet"""
+        if title not in self._worksheets:
+            self._worksheets[title] = self.spreadsheet.worksheet(title)
+        return self._worksheets[title]
+
+    def load_players(self):
+        return self.worksheet("Players").get_all_records(expected_headers=PLAYER_COLUMNS)
+
+    def player_names(self):
+        return self.worksheet("Players").col_values(1)[1:]
+
+    def load_matches(self, start=0):
+        matches_sheet = self.worksheet("Matches")
+        if start == 0:
+            records = matches_sheet.get_all_records(expected_headers=MATCH_RESULT_COLUMNS)
+            if records and 'match_id' not in records[0]:
+                # Sheets from before match ids: name the column new rows fill
+                matches_sheet.update(f"{MATCHES_LAST_COLUMN}1", [['match_id']])
+            return [[record.get(column, '') for column in MATCH_COLUMNS] for record in records]
+
+        # Header is sheet row 1, so sequence number n is sheet row n + 2; Sheets drops
+        # trailing empty cells
+        rows = matches_sheet.get(f"A{start + 2}:{MATCHES_LAST_COLUMN}")
+        return [list(row) + [''] * (len(MATCH_COLUMNS) - len(row)) for row in rows]
+
+    def has_header(self, worksheet):
+        """True if the worksheet's first row is filled, checked once per worksheet"""
+        if worksheet.title not in self._headers and worksheet.row_values(1):
+            self._headers.add(worksheet.title)
+        return worksheet.title in self._headers
+
+    def write(self, changes):
+        """Full rewrites first, then every append and row rewrite in a single batchUpdate.
+
+        A match and its ratings are therefore stored together or not at all.
+        Appending to an empty worksheet writes its header row first, in the
+        same batchUpdate.
+        """
+        players_sheet = self.worksheet("Players")
+        matches_sheet = self.worksheet("Matches")
+        if changes['replace_players'] is not None:
+            players_sheet.update([PLAYER_COLUMNS] + changes['replace_players'])
+        if changes['replace_matches'] is not None:
+            matches_sheet.update([MATCH_COLUMNS] + changes['replace_matches'])
+
+        requests = [_update_row_request(players_sheet, row_index, row)
+                    for row_index, row in sorted(changes['player_updates'].items())]
+        for worksheet, columns, rows in ((players_sheet, PLAYER_COLUMNS, changes['player_appends']),
+                                         (matches_sheet, MATCH_COLUMNS, changes['match_appends'])):
+            if rows:
+                if not self.has_header(worksheet):
+                    # Player row -1 is the header row
+                    requests.append(_update_row_request(worksheet, -1, columns))
+                requests.append(_append_rows_request(worksheet, rows))
+        if requests:
+            self.spreadsheet.batch_update({'requests': requests})
+        if changes['match_appends']:
+            self._headers.add(matches_sheet.title)
+        if changes['player_appends']:
+            self._headers.add(players_sheet.title)
+        # appendCells does not say where the rows went. Reading them back here would
+        # resend the whole batch when the read fails, so the next sync learns them
+        return {}
+
+
+# SQLite
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    row INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    mu REAL NOT NULL,
+    sigma REAL NOT NULL,
+    created_at TEXT,
+    last_played TEXT
+);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+
+CREATE TABLE IF NOT EXISTS matches (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    team1_player1 TEXT NOT NULL,
+    team1_player2 TEXT NOT NULL,
+    team2_player1 TEXT NOT NULL,
+    team2_player2 TEXT NOT NULL,
+    winner INTEGER NOT NULL,
+    match_id TEXT NOT NULL DEFAULT ''
+);
+CREATE UNIQUE INDEX IF NOT EXISTS matches_match_id ON matches (match_id) WHERE match_id != '';
+"""
+
+_PLAYER_FIELDS = ', '.join(PLAYER_COLUMNS)
+_MATCH_FIELDS = ', '.join(MATCH_COLUMNS)
+
+
+class SQLiteStorage(StorageBackend):
+    """A local SQLite database in WAL mode, so reads never wait for the writer.
+
+    Each call opens its own connection, which keeps the backend safe to use
+    from the write-behind thread and from sessions at the same time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.location = 'sqlite:' + os.path.abspath(path)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SQLITE_SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        # WAL makes NORMAL durable against application crashes, at a fraction of FULL's fsyncs
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _query(self, sql, parameters=()):
+        with closing(self._connect()) as connection:
+            return connection.execute(sql, parameters).fetchall()
+
+    def load_players(self):
+        rows = self._query(f"SELECT {_PLAYER_FIELDS} FROM players ORDER BY row")
+        return [dict(zip(PLAYER_COLUMNS, row)) for row in rows]
+
+    def player_names(self):
+        return [name for name, in self._query("SELECT name FROM players ORDER BY row")]
+
+    def load_matches(self, start=0):
+        rows = self._query(f"SELECT {_MATCH_FIELDS} FROM matches ORDER BY seq LIMIT -1 OFFSET ?", (start,))
+        return [list(row) for row in rows]
+
+    def write(self, changes):
+        """Apply the whole changeset in one transaction; returns appended players' rows by name"""
+        with closing(self._connect()) as connection, connection:
+            if changes['replace_players'] is not None:
+                connection.execute("DELETE FROM players")
+                self._insert_players(connection, changes['replace_players'], first_row=0)
+            if changes['replace_matches'] is not None:
+                connection.execute("DELETE FROM matches")
+                self._insert_matches(connection, changes['replace_matches'])
+            connection.executemany(
+                f"UPDATE players SET {', '.join(f'{column} = ?' for column in PLAYER_COLUMNS)} WHERE row = ?",
+                [list(row) + [row_index] for row_index, row in sorted(changes['player_updates'].items())])
+            player_rows = {}
+            if changes['player_appends']:
+                first_row, = connection.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM players").fetchone()
+                self._insert_players(connection, changes['player_appends'], first_row)
+                player_rows = {row[0]: first_row + offset for offset, row in enumerate(changes['player_appends'])}
+            self._insert_matches(connection, changes['match_appends'])
+        return player_rows
+
+    @staticmethod
+    def _insert_players(connection, rows, first_row):
+        connection.executemany(
+            f"INSERT INTO players (row, {_PLAYER_FIELDS}) VALUES (?, {', '.join('?' * len(PLAYER_COLUMNS))})",
+            [[first_row + offset] + list(row) for offset, row in enumerate(rows)])
+
+    @staticmethod
+    def _insert_matches(connection, rows):
+        connection.executemany(
+            f"INSERT INTO matches ({_MATCH_FIELDS}) VALUES ({', '.join('?' * len(MATCH_COLUMNS))})",
+            [list(row) for row in rows])
+
+
+def open_storage(league_id=DEFAULT_LEAGUE, create=False):
+    """A new backend for a league: SQLite if WUZZLER_SQLITE is set, else Google Sheets.
+
+    Raises UnknownLeagueError for leagues other than the default one that
+    have no spreadsheet configured or no database yet; with `create`, a
+    missing SQLite database is created instead.
+    """
+    path = os.environ.get('WUZZLER_SQLITE')
+    if path:
+        if league_id != DEFAULT_LEAGUE:
+            root, extension = os.path.splitext(path)
+            path = f"{root}-{league_id}{extension}"
+            if not create and not os.path.exists(path):
+                raise UnknownLeagueError(league_id)
+        return SQLiteStorage(path)
+    if league_id == DEFAULT_LEAGUE:
+        return SheetsStorage()
+    urls = st.secrets.get('leagues', {})
+    if league_id not in urls:
+        raise UnknownLeagueError(league_id)
+    return SheetsStorage(url=urls[league_id])
+
+def get_storage(league_id=None):
+    """Storage backend of a league, by default the current one"""
+    return get_league(league_id).storage
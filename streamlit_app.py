@@ -1,9 +1,20 @@
+import os
+
+import pandas as pd
 import streamlit as st
 
 # Import our modules
-from models import initialize_data, add_player, get_all_players, record_match, save_data
-from rating_system import update_ratings, get_leaderboard
-from utils import get_player_stats, get_recent_matches, get_most_frequent_teammates
+from bulk_import import MatchImportError, import_matches
+from instrumentation import export_metrics, metrics, to_prometheus
+from league import DEFAULT_LEAGUE, UnknownLeagueError, get_league, select_league
+from matchmaking import find_balanced_matches, win_probability
+from models import initialize_data, add_player, get_all_players, pending_writes, get_write_queue
+from rating_system import (LEADERBOARD_PERIODS, get_display_rating, get_leaderboard, get_rating_at,
+                           get_rating_curves, record_match_result)
+from utils import get_player_details, get_recent_matches
+
+# Players per page in the Player Management tab
+PLAYERS_PER_PAGE = 25
 
 # Page configuration
 st.set_page_config(
@@ -13,9 +24,25 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Every league is served by this app under ?league=<id>; without it, the default league
+league_id = st.query_params.get('league', DEFAULT_LEAGUE)
+select_league(league_id)
+try:
+    get_league()
+except UnknownLeagueError:
+    st.error(f"Unbekannte Liga: {league_id}")
+    st.stop()
+
 # Initialize data
 initialize_data()
 
+# A session that switches leagues starts its match setup over
+if st.session_state.get('league_id') != league_id:
+    for key in ('team1_player1', 'team1_player2', 'team2_player1', 'team2_player2',
+                'match_setup_mode', 'selecting_position', 'open_players'):
+        st.session_state.pop(key, None)
+    st.session_state.league_id = league_id
+
 # Initialize session state for match setup
 if 'team1_player1' not in st.session_state:
     st.session_state.team1_player1 = None
@@ -27,12 +54,22 @@ if 'team2_player2' not in st.session_state:
     st.session_state.team2_player2 = None
 if 'match_setup_mode' not in st.session_state:
     st.session_state.match_setup_mode = False
+if 'open_players' not in st.session_state:
+    st.session_state.open_players = set()
 
 # App title
-st.title("⚽ adesso Wuzzler Scoreboard")
+st.title("⚽ adesso Wuzzler Scoreboard" + (f" – {league_id}" if league_id != DEFAULT_LEAGUE else ""))
 
-# Tabs for different sections
-tab1, tab2, tab3 = st.tabs(["Spielen", "Leaderboard", "Spieler verwalten"])
+# Saves happen in the background; show when some have not been stored yet
+if pending_writes():
+    st.caption(f"⏳ {pending_writes()} pending write(s)")
+if get_write_queue().last_error is not None:
+    st.warning(f"Saving failed, retrying: {get_write_queue().last_error}")
+
+# Tabs for different sections; the performance panel only shows with WUZZLER_ADMIN=1
+show_admin = os.environ.get('WUZZLER_ADMIN') == '1'
+tab_names = ["Spielen", "Leaderboard", "Spieler verwalten"] + (["Admin"] if show_admin else [])
+tab1, tab2, tab3, *admin_tab = st.tabs(tab_names)
 
 with tab1:
     st.header("Play Match")
@@ -161,25 +198,22 @@ with tab1:
     )
 
     if all_players_selected and not st.session_state.match_setup_mode:
+        team1_chance = win_probability(
+            (st.session_state.team1_player1, st.session_state.team1_player2),
+            (st.session_state.team2_player1, st.session_state.team2_player2)
+        )
+        st.caption(f"Predicted: Team 1 {team1_chance * 100:.0f}% – {(1 - team1_chance) * 100:.0f}% Team 2")
+
         with col2:
             if st.button("Team 1 Wins! 🏆", key="team1_wins_btn", use_container_width=True):
-                # Record match with team 1 as winner
-                record_match(
-                    st.session_state.team1_player1,
-                    st.session_state.team1_player2,
-                    st.session_state.team2_player1,
-                    st.session_state.team2_player2,
-                    winner=1
-                )
-                # Update ratings
-                update_ratings(
+                # Record match with team 1 as winner, update ratings and save once
+                record_match_result(
                     st.session_state.team1_player1,
                     st.session_state.team1_player2,
                     st.session_state.team2_player1,
                     st.session_state.team2_player2,
                     winner=1
                 )
-                save_data()
                 st.success("Match recorded! Team 1 wins!")
                 # Reset match setup
                 st.session_state.team1_player1 = None
@@ -190,23 +224,14 @@ with tab1:
 
         with col3:
             if st.button("Team 2 Wins! 🏆", key="team2_wins_btn", use_container_width=True):
-                # Record match with team 2 as winner
-                record_match(
+                # Record match with team 2 as winner, update ratings and save once
+                record_match_result(
                     st.session_state.team1_player1,
                     st.session_state.team1_player2,
                     st.session_state.team2_player1,
                     st.session_state.team2_player2,
                     winner=2
                 )
-                # Update ratings
-                update_ratings(
-                    st.session_state.team1_player1,
-                    st.session_state.team1_player2,
-                    st.session_state.team2_player1,
-                    st.session_state.team2_player2,
-                    winner=2
-                )
-                save_data()
                 st.success("Match recorded! Team 2 wins!")
                 # Reset match setup
                 st.session_state.team1_player1 = None
@@ -215,6 +240,29 @@ with tab1:
                 st.session_state.team2_player2 = None
                 st.rerun()
 
+    # Matchmaking: suggest the fairest teams from the players who are here
+    with st.expander("Matchmaking"):
+        present_players = st.multiselect("Present players", get_all_players()['name'].tolist(),
+                                         key="present_players")
+        if len(present_players) >= 4:
+            for i, suggestion in enumerate(find_balanced_matches(present_players)):
+                (t1p1, t1p2), (t2p1, t2p2) = suggestion['team1'], suggestion['team2']
+                chance = suggestion['team1_win_probability']
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    st.info(f"**{t1p1}** & **{t1p2}** vs **{t2p1}** & **{t2p2}** "
+                            f"({chance * 100:.0f}% – {(1 - chance) * 100:.0f}%)")
+                with col2:
+                    if st.button("Use", key=f"use_suggestion_{i}", use_container_width=True):
+                        st.session_state.team1_player1 = t1p1
+                        st.session_state.team1_player2 = t1p2
+                        st.session_state.team2_player1 = t2p1
+                        st.session_state.team2_player2 = t2p2
+                        st.session_state.match_setup_mode = False
+                        st.rerun()
+        else:
+            st.caption("Select at least four players.")
+
     # Recent matches
     st.divider()
     st.subheader("Recent Matches")
@@ -228,17 +276,18 @@ with tab1:
 with tab2:
     st.header("Leaderboard")
 
-    leaderboard = get_leaderboard()
+    # Matches, wins and win rate count only the chosen period; ratings are always all-time
+    period = st.radio("Period", LEADERBOARD_PERIODS, horizontal=True, key="leaderboard_period")
+    leaderboard = get_leaderboard(period)
     if len(leaderboard) > 0:
         # Format the leaderboard for display
         display_board = leaderboard.copy()
         display_board['Rating'] = display_board['display_rating'].round(1)
         display_board['Uncertainty'] = display_board['sigma'].round(2)
-
-        # Add player stats
-        display_board['Matches'] = display_board['name'].apply(lambda x: get_player_stats(x)['matches_played'])
-        display_board['Wins'] = display_board['name'].apply(lambda x: get_player_stats(x)['wins'])
-        display_board['Win Rate'] = display_board['name'].apply(lambda x: f"{get_player_stats(x)['win_rate']:.1f}%")
+        display_board['Matches'] = display_board['matches']
+        display_board['Wins'] = display_board['wins']
+        win_rate = display_board['wins'] / display_board['matches'].where(display_board['matches'] > 0) * 100
+        display_board['Win Rate'] = win_rate.fillna(0.0).map(lambda rate: f"{rate:.1f}%")
 
         # Display the leaderboard with rank
         st.dataframe(
@@ -246,6 +295,30 @@ with tab2:
             use_container_width=True,
             hide_index=True
         )
+
+        # Rating curves come from the recorded history; only built once someone looks
+        if st.checkbox("Show rating history", key="show_rating_history"):
+            chart_players = st.multiselect("Players", display_board['name'].tolist(),
+                                           default=display_board['name'].head(5).tolist(),
+                                           key="history_players")
+            curves = get_rating_curves(chart_players)
+            if len(curves) > 0:
+                st.line_chart(curves, y_label="Rating")
+            else:
+                st.info("No rated matches for these players yet.")
+
+            as_of = st.date_input("Rating as of", value=None, key="history_as_of")
+            if as_of is not None and chart_players:
+                # Ratings at the end of the chosen day
+                as_of_time = pd.Timestamp(as_of) + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+                ratings = [get_rating_at(name, as_of_time) for name in chart_players]
+                st.dataframe(pd.DataFrame({
+                    'Player': chart_players,
+                    'Rating': [None if rating is None else round(get_display_rating(*rating), 1)
+                               for rating in ratings],
+                }), hide_index=True)
+    elif period != 'All Time':
+        st.info("No matches played in this period yet.")
     else:
         st.info("No players in the leaderboard yet.")
 
@@ -264,31 +337,122 @@ with tab3:
             else:
                 st.error("Player already exists or name is empty.")
 
-    # List all players
+    # Import historical matches
+    with st.expander("Import Matches"):
+        st.caption("CSV or JSON Lines with the columns date, team1_player1, team1_player2, "
+                   "team2_player1, team2_player2 and winner (1 or 2). Unknown players are created.")
+        uploaded = st.file_uploader("Match file", type=["csv", "jsonl", "json"], key="import_file")
+        if uploaded is not None and st.button("Import", key="import_btn"):
+            try:
+                summary = import_matches(uploaded)
+            except MatchImportError as e:
+                st.error("Import failed, nothing was changed.")
+                st.code(str(e), language=None)
+            else:
+                st.success(f"Imported {summary['matches']} matches and {len(summary['new_players'])} new players.")
+
+    # List all players, one page at a time
     st.subheader("All Players")
     players = get_all_players()
     if len(players) > 0:
-        for _, player in players.iterrows():
-            with st.expander(f"{player['name']}"):
-                stats = get_player_stats(player['name'])
+        search = st.text_input("Search", key="player_search", placeholder="Player name")
+        if search:
+            players = players[players['name'].astype(str).str.contains(search, case=False, regex=False)]
+
+        page_count = max(1, -(-len(players) // PLAYERS_PER_PAGE))
+        # The widget reads its value from session state; a narrower search can
+        # leave the remembered page past the end
+        st.session_state.setdefault('player_page', 1)
+        if st.session_state.player_page > page_count:
+            st.session_state.player_page = page_count
+        page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key="player_page")
+        st.caption(f"{len(players)} player(s), page {page} of {page_count}")
+        start = (page - 1) * PLAYERS_PER_PAGE
+        page_players = players.iloc[start:start + PLAYERS_PER_PAGE]
+
+        for player in page_players.itertuples(index=False):
+            is_open = player.name in st.session_state.open_players
+            if st.button(f"{'▾' if is_open else '▸'} {player.name}", key=f"details_{player.name}",
+                         use_container_width=True):
+                st.session_state.open_players ^= {player.name}
+                st.rerun()
+
+            # Details are only computed for players whose view is open
+            if is_open:
+                details = get_player_details(player.name)
+                stats = details['stats']
 
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.metric("Rating", f"{(player['mu'] - 3*player['sigma']):.1f}")
+                    st.metric("Rating", f"{(player.mu - 3*player.sigma):.1f}")
                 with col2:
                     st.metric("Matches", stats['matches_played'])
                 with col3:
                     st.metric("Win Rate", f"{stats['win_rate']:.1f}%")
 
                 # Show frequent teammates
-                teammates = get_most_frequent_teammates(player['name'])
-                if teammates:
+                if details['teammates']:
                     st.subheader("Frequent Teammates")
-                    for teammate in teammates:
+                    for teammate in details['teammates']:
                         st.info(f"{teammate['name']} ({teammate['count']} matches)")
+
+                # Best partner and nemesis need a few games together to mean anything
+                col1, col2 = st.columns(2)
+                with col1:
+                    for partner in details['best_partners']:
+                        st.success(f"Best Partner: {partner['name']} ({partner['win_rate']:.0f}% in {partner['games']} matches)")
+                with col2:
+                    for nemesis in details['nemeses']:
+                        st.error(f"Nemesis: {nemesis['name']} ({nemesis['loss_rate']:.0f}% losses in {nemesis['games']} matches)")
+        if len(page_players) == 0:
+            st.info("No players match the search.")
     else:
         st.info("No players added yet.")
 
+if show_admin:
+    with admin_tab[0]:
+        st.header("Performance")
+        snapshot = metrics.snapshot()
+
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("API Calls", snapshot['api']['calls'])
+        with col2:
+            st.metric("KB Sent", f"{snapshot['api']['bytes_sent'] / 1024:.1f}")
+        with col3:
+            st.metric("KB Received", f"{snapshot['api']['bytes_received'] / 1024:.1f}")
+        with col4:
+            st.metric("Pending Writes", pending_writes())
+
+        if snapshot['operations']:
+            timings = pd.DataFrame.from_dict(snapshot['operations'], orient='index')
+            timings = timings[['count', 'errors', 'p50_s', 'p90_s', 'p99_s', 'last_s', 'total_s']] * [1, 1, 1000, 1000, 1000, 1000, 1]
+            st.dataframe(
+                timings.rename(columns={
+                    'count': 'Calls', 'errors': 'Errors', 'p50_s': 'p50 (ms)', 'p90_s': 'p90 (ms)',
+                    'p99_s': 'p99 (ms)', 'last_s': 'Last (ms)', 'total_s': 'Total (s)'
+                }).sort_values('Total (s)', ascending=False).round(2),
+                use_container_width=True
+            )
+        else:
+            st.info("No timings recorded yet.")
+
+        if snapshot['api']['calls_by_method']:
+            st.subheader("API Calls by Method")
+            st.json(snapshot['api']['calls_by_method'])
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("Export JSON", key="export_metrics_json", use_container_width=True):
+                st.success(f"Written to {export_metrics(os.path.join('.cache', 'metrics.json'))}")
+        with col2:
+            st.download_button("Download Prometheus", to_prometheus(snapshot), file_name="metrics.prom",
+                               mime="text/plain", use_container_width=True)
+        with col3:
+            if st.button("Reset Metrics", key="reset_metrics", use_container_width=True):
+                metrics.reset()
+                st.rerun()
+
 # Footer
 st.divider()
 st.caption("Table Soccer Tracker - Built with Streamlit and OpenSkill")
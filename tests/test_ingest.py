@@ -0,0 +1,62 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from ingest import IngestHandler, ResultError, validate_results
+from league import get_league_cache, using_league
+from models import add_player, get_write_queue, initialize_data
+import storage as storage_module
+from storage import SQLiteStorage
+
+RESULT = {'team1_player1': 'A', 'team1_player2': 'B', 'team2_player1': 'C', 'team2_player2': 'D'}
+
+
+@pytest.fixture
+def league(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage_module, 'open_storage',
+                        lambda league_id, create: SQLiteStorage(str(tmp_path / 'league.db')))
+    get_league_cache.clear()
+    with using_league('default'):
+        initialize_data(background=False)
+        for name in 'ABCD':
+            add_player(name)
+        yield
+    get_write_queue().flush(timeout=30)
+    get_league_cache.clear()
+
+
+@pytest.fixture
+def server(league, monkeypatch):
+    monkeypatch.delenv('WUZZLER_INGEST_TOKEN', raising=False)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), IngestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('winner', [1, 2, '1', '2'])
+def test_winner_is_team_number(league, winner):
+    assert validate_results(dict(RESULT, winner=winner)) == [('A', 'B', 'C', 'D', int(winner))]
+
+
+@pytest.mark.parametrize('winner', [True, 1.0, 2.0, 0, 3, '3', ' 1', None, [1]])
+def test_winner_of_another_type_or_value_is_rejected(league, winner):
+    with pytest.raises(ResultError, match="winner must be 1 or 2"):
+        validate_results(dict(RESULT, winner=winner))
+
+
+@pytest.mark.parametrize('length', ['abc', '-5'])
+def test_invalid_content_length_is_a_bad_request(server, length):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=10)
+    connection.putrequest('POST', '/matches')
+    connection.putheader('Content-Length', length)
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 400
+    assert json.load(response) == {'errors': ["Content-Length must be a non-negative integer"]}
+    connection.close()
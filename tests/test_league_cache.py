@@ -0,0 +1,54 @@
+import pytest
+
+from league import LeagueCache, get_league, get_league_cache, using_league
+from models import add_player, get_write_queue, initialize_data
+from rating_system import record_match_result
+import storage as storage_module
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Every league gets its own SQLite database"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage_module, 'open_storage',
+                        lambda league_id, create: SQLiteStorage(str(tmp_path / f'{league_id}.db')))
+    get_league_cache.clear()
+    yield
+    get_write_queue().flush(timeout=30)
+    get_league_cache.clear()
+
+
+def test_least_recently_used_leagues_are_evicted_once_saved():
+    cache = LeagueCache(lambda league_id, create: None, budget=0)
+    first = cache.get('first')
+    cache.get('second')
+
+    # Rating changes not handed to the write queue yet would be lost
+    first.dirty_players.add(0)
+    assert cache.trim() == []
+    assert 'first' in cache
+
+    first.dirty_players.clear()
+    assert cache.trim() == ['first']
+    # The most recently used league always stays
+    assert 'second' in cache and len(cache) == 1
+
+
+def test_a_league_evicted_during_a_run_stays_loaded_for_the_rest_of_it(storage):
+    with using_league('a'):
+        initialize_data(background=False)
+        for name in 'ABCD':
+            add_player(name)
+    assert get_write_queue().flush(timeout=30)
+
+    with using_league('a'):
+        initialize_data(background=False)
+        # Another session loads its league meanwhile, which evicts this one
+        get_league_cache().budget = 0
+        with using_league('b'):
+            initialize_data(background=False)
+        assert 'a' not in get_league_cache()
+
+        record_match_result('A', 'B', 'C', 'D', 1)
+        assert len(get_league().matches) == 1
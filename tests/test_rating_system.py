@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from league import DEFAULT_MU, DEFAULT_SIGMA, TEAM_COLUMNS, get_league_cache
+import rating_system
+from rating_system import get_model, replay_ratings
+import storage as storage_module
+
+
+@pytest.fixture(autouse=True)
+def league(monkeypatch):
+    """replay_ratings() looks up the current league even when given players and matches"""
+    monkeypatch.setattr(storage_module, 'open_storage', lambda league_id, create: None)
+    get_league_cache.clear()
+    yield
+    get_league_cache.clear()
+
+
+def random_league(player_count, match_count, seed=0):
+    rng = np.random.default_rng(seed)
+    names = [f"p{i}" for i in range(player_count)]
+    seats = np.array([rng.choice(player_count, 4, replace=False) for _ in range(match_count)])
+    matches = pd.DataFrame({'date': pd.date_range('2026-01-01', periods=match_count, freq='min').astype(str)})
+    for seat, column in enumerate(TEAM_COLUMNS):
+        matches[column] = np.array(names)[seats[:, seat]]
+    matches['winner'] = rng.integers(1, 3, match_count)
+    return pd.DataFrame({'name': names}), matches
+
+
+def rate_one_by_one(players, matches):
+    """Ratings from applying every match with the OpenSkill model itself"""
+    model = get_model()
+    ratings = {name: model.rating(mu=DEFAULT_MU, sigma=DEFAULT_SIGMA) for name in players['name']}
+    for match in matches.itertuples(index=False):
+        team1 = [ratings[match.team1_player1], ratings[match.team1_player2]]
+        team2 = [ratings[match.team2_player1], ratings[match.team2_player2]]
+        team1, team2 = model.rate([team1, team2], ranks=[0, 1] if match.winner == 1 else [1, 0])
+        ratings[match.team1_player1], ratings[match.team1_player2] = team1
+        ratings[match.team2_player1], ratings[match.team2_player2] = team2
+    return (np.array([ratings[name].mu for name in players['name']]),
+            np.array([ratings[name].sigma for name in players['name']]))
+
+
+@pytest.mark.parametrize('player_count, wide_waves', [(8, False), (5000, True)])
+def test_replay_matches_the_openskill_model(monkeypatch, player_count, wide_waves):
+    players, matches = random_league(player_count, 3000)
+    waves = []
+    rate_wave = rating_system._rate_wave
+    monkeypatch.setattr(rating_system, '_rate_wave', lambda *args: (waves.append(1), rate_wave(*args)))
+
+    mu, sigma = replay_ratings(players, matches)
+
+    # Small leagues take the sequential loop, large ones the vectorised waves
+    assert bool(waves) == wide_waves
+    expected_mu, expected_sigma = rate_one_by_one(players, matches)
+    np.testing.assert_allclose(mu, expected_mu, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(sigma, expected_sigma, rtol=0, atol=1e-9)
@@ -0,0 +1,199 @@
+"""Several writers sharing one SQLite database must end up with the same stored league."""
+import uuid
+
+import pandas as pd
+import pytest
+
+from league import get_league, get_league_cache, using_league
+from models import add_player, get_write_queue, initialize_data, sync_from_storage
+from rating_system import get_rating_history, record_match_result
+import storage as storage_module
+from fake_gspread import FakeSpreadsheet
+from storage import SheetsStorage, SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Leagues of this process all share one database, so each league id acts as a separate writer"""
+    # Warm-start snapshots go to .cache/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'league.db')
+    monkeypatch.setattr(storage_module, 'open_storage', lambda league_id, create: SQLiteStorage(path))
+    get_league_cache.clear()
+    yield SQLiteStorage(path)
+    get_write_queue().flush(timeout=30)
+    get_league_cache.clear()
+
+
+@pytest.fixture
+def spreadsheet(tmp_path, monkeypatch):
+    """Leagues of this process all share one fake spreadsheet"""
+    monkeypatch.chdir(tmp_path)
+    spreadsheet = FakeSpreadsheet()
+    spreadsheet.add_worksheet('Players')
+    spreadsheet.add_worksheet('Matches')
+    monkeypatch.setattr(storage_module, 'open_storage',
+                        lambda league_id, create: SheetsStorage(spreadsheet, url='fake://test'))
+    get_league_cache.clear()
+    yield spreadsheet
+    get_write_queue().flush(timeout=30)
+    get_league_cache.clear()
+
+
+def append_match(storage, date, seats, winner):
+    """Store a match as another writer would"""
+    storage.write({'storage': storage, 'replace_players': None, 'replace_matches': None, 'player_updates': {},
+                   'player_appends': [], 'match_appends': [[date, *seats, winner, uuid.uuid4().hex]]})
+
+
+def flush():
+    assert get_write_queue().flush(timeout=30)
+
+
+def stored_players(storage):
+    return {row['name']: row for row in storage.load_players()}
+
+
+def test_writers_starting_on_empty_tables_keep_each_others_matches(storage):
+    with using_league('a'):
+        initialize_data(background=False)
+        for name in 'ABCD':
+            add_player(name)
+    flush()
+    with using_league('b'):
+        initialize_data(background=False)
+
+    for _ in range(5):
+        for writer in 'ab':
+            with using_league(writer):
+                record_match_result('A', 'B', 'C', 'D', 1)
+    flush()
+
+    assert len(storage.load_matches()) == 10
+    assert sorted(stored_players(storage)) == ['A', 'B', 'C', 'D']
+
+
+def test_ratings_of_newly_appended_players_are_saved(storage):
+    with using_league('a'):
+        initialize_data(background=False)
+        for name in 'ABCD':
+            add_player(name)
+        record_match_result('A', 'B', 'C', 'D', 1)
+        flush()
+        players = get_league().players
+
+    stored = stored_players(storage)
+    for name, mu, sigma in players[['name', 'mu', 'sigma']].itertuples(index=False):
+        assert stored[name]['mu'] == pytest.approx(mu)
+        assert stored[name]['sigma'] == pytest.approx(sigma)
+        assert stored[name]['last_played'] != 'None'
+
+
+def test_ratings_a_sync_changes_are_saved(storage):
+    with using_league('a'):
+        initialize_data(background=False)
+        for name in 'ABCD':
+            add_player(name)
+    flush()
+    with using_league('b'):
+        initialize_data(background=False)
+    with using_league('a'):
+        record_match_result('A', 'B', 'C', 'D', 1)
+    with using_league('b'):
+        record_match_result('A', 'C', 'B', 'D', 2)
+    flush()
+
+    # Only syncs happen from here on; whatever they change must still reach storage
+    for writer in 'ab':
+        with using_league(writer):
+            sync_from_storage()
+    flush()
+
+    with using_league('a'):
+        ratings = dict(zip(get_league().players['name'], get_league().players['mu']))
+    with using_league('fresh'):
+        initialize_data(background=False)
+        reloaded = dict(zip(get_league().players['name'], get_league().players['mu']))
+    assert reloaded == pytest.approx(ratings)
+    assert {name: row['mu'] for name, row in stored_players(storage).items()} == pytest.approx(ratings)
+
+
+def test_readers_rate_the_log_in_sequence_order_whatever_their_sync_boundaries(storage):
+    with using_league('a'):
+        initialize_data(background=False)
+        for name in 'ABCD':
+            add_player(name)
+    flush()
+    for reader in ('once', 'twice'):
+        with using_league(reader):
+            initialize_data(background=False)
+
+    # A delayed write stores the later match first
+    append_match(storage, '2026-01-01 10:00:05', 'ABCD', 1)
+    with using_league('twice'):
+        sync_from_storage()
+    append_match(storage, '2026-01-01 10:00:00', 'ACBD', 1)
+    for reader in ('once', 'twice'):
+        with using_league(reader):
+            sync_from_storage()
+    flush()
+
+    with using_league('once'):
+        once = get_league().players['mu'].tolist()
+    with using_league('twice'):
+        twice = get_league().players['mu'].tolist()
+    assert once == pytest.approx(twice)
+
+
+def test_rating_history_survives_syncs_and_warm_starts(storage):
+    with using_league('a'):
+        initialize_data(background=False)
+        for name in 'ABCD':
+            add_player(name)
+        record_match_result('A', 'B', 'C', 'D', 1)
+        history = get_rating_history()
+    flush()
+    with using_league('b'):
+        initialize_data(background=False)
+        record_match_result('A', 'C', 'B', 'D', 1)
+    flush()
+
+    with using_league('a'):
+        sync_from_storage()
+        league = get_league()
+        # Extended with the other writer's match instead of replayed from scratch
+        assert league.rating_history is history
+        assert len(history) == 8
+        now = pd.Timestamp.now()
+        for idx, mu, sigma in league.players[['mu', 'sigma']].itertuples():
+            assert history.rating_at(idx, now) == pytest.approx((mu, sigma))
+
+    # A warm start restores the history with the rest of the league
+    get_league_cache.clear()
+    with using_league('a'):
+        initialize_data(background=False)
+        assert get_league().rating_history is not None
+        assert len(get_league().rating_history) == 8
+
+
+def test_matches_stored_twice_by_a_retried_write_count_once(spreadsheet):
+    with using_league('a'):
+        initialize_data(background=False)
+        for name in 'ABCD':
+            add_player(name)
+        record_match_result('A', 'B', 'C', 'D', 1)
+    flush()
+    # Sheets took the batch, but the response was lost and the write queue resent it
+    matches = spreadsheet.worksheet('Matches')
+    matches.rows.append(list(matches.rows[-1]))
+
+    with using_league('a'):
+        sync_from_storage()
+        assert len(get_league().matches) == 1
+        ratings = get_league().players['mu'].tolist()
+    with using_league('b'):
+        initialize_data(background=False)
+        assert len(get_league().matches) == 1
+        assert get_league().players['mu'].tolist() == pytest.approx(ratings)
+        sync_from_storage()
+        assert len(get_league().matches) == 1
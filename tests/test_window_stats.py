@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from league import TEAM_COLUMNS
+from match_log import NAT, MatchLog
+from window_stats import WindowStats
+
+
+def random_log(player_count, match_count, rng):
+    dates = pd.Series(pd.Timestamp('2026-01-01') + pd.to_timedelta(rng.integers(0, 90 * 24, match_count), unit='h'))
+    matches = pd.DataFrame({'date': dates.astype(str)})
+    # Matches with unparseable dates only count without bounds
+    matches.loc[rng.random(match_count) < 0.02, 'date'] = ''
+    seats = np.array([rng.choice(player_count, 4, replace=False) for _ in range(match_count)])
+    for seat, column in enumerate(TEAM_COLUMNS):
+        matches[column] = seats[:, seat]
+    matches['winner'] = rng.integers(1, 3, match_count)
+    return MatchLog.from_frame(matches, {idx: idx for idx in range(player_count)})
+
+
+def scan(log, player_count, start, end):
+    """(matches, wins) by player from going through every match"""
+    matches = np.zeros(player_count, dtype=np.int64)
+    wins = np.zeros(player_count, dtype=np.int64)
+    dates = log.column('date')
+    lower = NAT if start is None else pd.Timestamp(start).value
+    for row, (ids, winner) in enumerate(zip(log.player_ids().tolist(), log.column('winner').tolist())):
+        if dates[row] < lower or (end is not None and dates[row] >= pd.Timestamp(end).value):
+            continue
+        for seat, idx in enumerate(ids):
+            matches[idx] += 1
+            wins[idx] += (seat < 2) == (winner == 1)
+    return matches, wins
+
+
+def test_counts_match_a_scan_of_the_log_including_its_unindexed_tail():
+    rng = np.random.default_rng(0)
+    player_count = 20
+    log = random_log(player_count, 2000, rng)
+    stats = WindowStats(log)
+    # Appended after the index was built, so counted from the tail
+    log.extend(random_log(player_count, 300, rng))
+    assert not stats.needs_rebuild(log)
+
+    bounds = sorted(pd.Timestamp('2025-12-25') + pd.to_timedelta(rng.integers(0, 100 * 24, 400), unit='h'))
+    windows = [(None, None), (None, bounds[200]), (bounds[200], None)]
+    windows += [tuple(bounds[i] for i in sorted(rng.choice(len(bounds), 2))) for _ in range(200)]
+    for start, end in windows:
+        matches, wins = stats.counts(player_count, start, end)
+        expected_matches, expected_wins = scan(log, player_count, start, end)
+        np.testing.assert_array_equal(matches, expected_matches)
+        np.testing.assert_array_equal(wins, expected_wins)
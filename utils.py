@@ -1,29 +1,165 @@
+from collections import deque
+
+import numpy as np
 import pandas as pd
-import streamlit as st
 
-def get_player_stats(player_name):
-    """Get statistics for a specific player"""
-    if len(st.session_state.matches) == 0:
-        return {
-            'matches_played': 0,
-            'wins': 0,
-            'losses': 0,
-            'win_rate': 0.0
-        }
+from instrumentation import timed
+from league import RECENT_MATCHES_SIZE, get_league
+from match_log import NAT, SEAT_COLUMNS
+from window_stats import WindowStats
+
+def _empty_stats():
+    return {
+        'matches_played': 0,
+        'wins': 0,
+        'losses': 0,
+        'last_played': None
+    }
+
+@timed('build_player_stats_index')
+def build_player_stats_index(match_log, names):
+    """Aggregate matches played, wins, losses and last played per player"""
+    if len(match_log) == 0:
+        return {}
+
+    player_count = len(names)
+    ids = match_log.player_ids()
+    winner = match_log.column('winner')
+    dates = match_log.column('date')
 
-    matches = st.session_state.matches
+    # Seats 0-1 are team 1, seats 2-3 team 2
+    team1_won = winner == 1
+    team2_won = winner == 2
+    won = np.stack([team1_won, team1_won, team2_won, team2_won], axis=1)
+
+    matches_played = np.bincount(ids.ravel(), minlength=player_count)
+    wins = np.bincount(ids.ravel(), weights=won.ravel(), minlength=player_count).astype(int)
+    last_played = np.full(player_count, NAT)
+    np.maximum.at(last_played, ids.ravel(), np.repeat(dates, 4))
+
+    index = {}
+    for player_id in np.flatnonzero(matches_played):
+        index[names[player_id]] = {
+            'matches_played': int(matches_played[player_id]),
+            'wins': int(wins[player_id]),
+            'losses': int(matches_played[player_id] - wins[player_id]),
+            'last_played': None if last_played[player_id] == NAT else pd.Timestamp(last_played[player_id])
+        }
+    return index
 
-    # Count matches where player participated
-    player_matches = matches[
-        (matches['team1_player1'] == player_name) | 
-        (matches['team1_player2'] == player_name) | 
-        (matches['team2_player1'] == player_name) | 
-        (matches['team2_player2'] == player_name)
+def update_player_stats_index(index, team1_player1, team1_player2, team2_player1, team2_player2, winner, date):
+    """Apply a single match result to the stats index in place"""
+    seats = [
+        (team1_player1, 1),
+        (team1_player2, 1),
+        (team2_player1, 2),
+        (team2_player2, 2),
     ]
+    for name, team in seats:
+        stats = index.setdefault(name, _empty_stats())
+        stats['matches_played'] += 1
+        if team == int(winner):
+            stats['wins'] += 1
+        else:
+            stats['losses'] += 1
+        # Matches merged from other writers can be older than the player's latest
+        if stats['last_played'] is None or (date is not None and date > stats['last_played']):
+            stats['last_played'] = date
+
+# Seat layout of MatchLog.player_ids(): team 1 is seats 0-1, team 2 is seats 2-3
+PARTNER_SEAT = [1, 0, 3, 2]
+OPPONENT_SEATS = [[2, 3], [2, 3], [0, 1], [0, 1]]
+
+# Fewest games a pair needs before best partner / nemesis rankings consider it
+MIN_PAIR_GAMES = 3
+
+def _count_pairs(first, second, won):
+    """Distinct (first, second) id pairs with their games and wins"""
+    # One int64 key per pair sorts much faster than unique rows
+    size = int(max(first.max(), second.max())) + 1
+    keys, inverse = np.unique(first.astype(np.int64) * size + second, return_inverse=True)
+    inverse = inverse.ravel()
+    games = np.bincount(inverse, minlength=len(keys))
+    wins = np.bincount(inverse, weights=won, minlength=len(keys)).astype(int)
+    return zip(zip((keys // size).tolist(), (keys % size).tolist()), games.tolist(), wins.tolist())
+
+@timed('build_pair_index')
+def build_pair_index(match_log):
+    """Co-occurrence counts for every pair of players that met as partners or opponents"""
+    index = {}
+    if len(match_log) == 0:
+        return index
+
+    ids = match_log.player_ids()
+    winner = match_log.column('winner')
+    won = [winner == 1, winner == 1, winner == 2, winner == 2]
 
-    matches_played = len(player_matches)
+    partner_seats = [(seat, PARTNER_SEAT[seat]) for seat in range(4)]
+    opponent_seats = [(seat, other) for seat in range(4) for other in OPPONENT_SEATS[seat]]
+    for seats, games_column in ((partner_seats, 0), (opponent_seats, 2)):
+        first = np.concatenate([ids[:, seat] for seat, _ in seats])
+        second = np.concatenate([ids[:, other] for _, other in seats])
+        player_won = np.concatenate([won[seat] for seat, _ in seats])
+        for (player_id, other_id), games, wins in _count_pairs(first, second, player_won):
+            entry = index.setdefault(player_id, {}).setdefault(other_id, [0, 0, 0, 0])
+            entry[games_column] = games
+            entry[games_column + 1] = wins
+    return index
 
-    if matches_played == 0:
+def update_pair_index(index, ids, winner):
+    """Apply a single match, given as four player ids in seat order, to the pair index in place"""
+    winner = int(winner)
+    for seat, player_id in enumerate(ids):
+        won = int(winner == (1 if seat < 2 else 2))
+        pairs = index.setdefault(player_id, {})
+        entry = pairs.setdefault(ids[PARTNER_SEAT[seat]], [0, 0, 0, 0])
+        entry[0] += 1
+        entry[1] += won
+        for other in OPPONENT_SEATS[seat]:
+            entry = pairs.setdefault(ids[other], [0, 0, 0, 0])
+            entry[2] += 1
+            entry[3] += won
+
+def _render_match(date, team1_player1, team1_player2, team2_player1, team2_player2, winner):
+    """One Recent Matches row with its display strings"""
+    return {
+        'date': date,
+        'team1_player1': team1_player1,
+        'team1_player2': team1_player2,
+        'team2_player1': team2_player1,
+        'team2_player2': team2_player2,
+        'winner': winner,
+        'date_formatted': date.strftime('%Y-%m-%d %H:%M'),
+        'result': f"Team 1 ({team1_player1}, {team1_player2}) vs Team 2 ({team2_player1}, {team2_player2}) - Winner: {'Team 1' if winner == 1 else 'Team 2'}",
+    }
+
+def build_recent_matches(match_log, names, size=RECENT_MATCHES_SIZE):
+    """Pre-rendered buffer of the `size` latest matches, newest first"""
+    recent = deque(maxlen=size)
+    dates = match_log.column('date')
+    # Matches with unparseable dates are never shown
+    rows = np.flatnonzero(dates != NAT)
+    if len(rows) > size:
+        rows = rows[np.argpartition(dates[rows], -size)[-size:]]
+    rows = rows[np.argsort(dates[rows], kind='stable')[::-1]]
+
+    seats = [match_log.column(name) for name in SEAT_COLUMNS]
+    winners = match_log.column('winner')
+    for row in rows.tolist():
+        recent.append(_render_match(pd.Timestamp(dates[row]), *(names[seat[row]] for seat in seats),
+                                    int(winners[row])))
+    return recent
+
+def push_recent_match(recent, date, team1_player1, team1_player2, team2_player1, team2_player2, winner):
+    """Add a new newest match to the buffer, dropping the oldest if full"""
+    recent.appendleft(_render_match(pd.Timestamp(date), team1_player1, team1_player2,
+                                    team2_player1, team2_player2, int(winner)))
+
+@timed('get_player_stats')
+def get_player_stats(player_name):
+    """Get statistics for a specific player"""
+    stats = get_league().player_stats.get(player_name)
+    if stats is None or stats['matches_played'] == 0:
         return {
             'matches_played': 0,
             'wins': 0,
@@ -31,80 +167,90 @@ def get_player_stats(player_name):
             'win_rate': 0.0
         }
 
-    # Count wins
-    team1_wins = len(player_matches[
-        ((player_matches['team1_player1'] == player_name) | 
-         (player_matches['team1_player2'] == player_name)) &
-        (player_matches['winner'] == 1)
-    ])
-
-    team2_wins = len(player_matches[
-        ((player_matches['team2_player1'] == player_name) | 
-         (player_matches['team2_player2'] == player_name)) &
-        (player_matches['winner'] == 2)
-    ])
-
-    wins = team1_wins + team2_wins
-    losses = matches_played - wins
-    win_rate = (wins / matches_played) * 100
-
     return {
-        'matches_played': matches_played,
-        'wins': wins,
-        'losses': losses,
-        'win_rate': win_rate
+        'matches_played': stats['matches_played'],
+        'wins': stats['wins'],
+        'losses': stats['losses'],
+        'win_rate': (stats['wins'] / stats['matches_played']) * 100
     }
 
+def get_window_counts(start=None, end=None):
+    """(matches, wins) arrays by player id for matches dated in [start, end); all time by default"""
+    league = get_league()
+    with league.lock:
+        stats = league.window_stats
+        if stats is None or stats.needs_rebuild(league.matches):
+            stats = league.window_stats = WindowStats(league.matches)
+        return stats.counts(len(league.players), start, end)
+
+@timed('get_recent_matches')
 def get_recent_matches(limit=10):
-    """Get recent matches with results"""
-    print(st.session_state.matches)
-    print(type(st.session_state.matches))
-    matches = st.session_state.matches.copy()
-
-    # Check if the DataFrame is empty or if 'date' column does not exist
-    if matches.empty or 'date' not in matches.columns:
-        return pd.DataFrame()  # Return an empty DataFrame
-    
-    # Convert the 'date' column to datetime
-    matches['date'] = pd.to_datetime(matches['date'], errors='coerce')
-    
-    # Drop rows where 'date' conversion failed
-    matches = matches.dropna(subset=['date'])
-    # Format the 'date' column
-    matches['date_formatted'] = matches['date'].dt.strftime('%Y-%m-%d %H:%M')
-    
-    # Create the 'result' column
-    matches['result'] = matches.apply(
-        lambda row: f"Team 1 ({row['team1_player1']}, {row['team1_player2']}) vs Team 2 ({row['team2_player1']}, {row['team2_player2']}) - Winner: {'Team 1' if row['winner'] == 1 else 'Team 2'}",
-        axis=1
-    )
-    
-    # Sort by date and limit the number of recent matches
-    recent_matches = matches.sort_values(by='date', ascending=False).head(limit)
-    
-    return recent_matches
+    """Get recent matches with results, newest first"""
+    league = get_league()
+    if limit > RECENT_MATCHES_SIZE:
+        # More than the buffer holds: render straight from the match log
+        recent = build_recent_matches(league.matches, league.player_names(), size=limit)
+    else:
+        with league.lock:
+            recent = list(league.recent_matches)[:limit]
+    return pd.DataFrame(list(recent))
+
+def _pairs_of(player_name):
+    """(names, pair stats of the player) or (names, {}) for unknown players"""
+    league = get_league()
+    player_id = league.player_ids.get(player_name)
+    return league.player_names(), league.pair_stats.get(player_id, {})
 
+@timed('get_most_frequent_teammates')
 def get_most_frequent_teammates(player_name, limit=3):
     """Find most frequent teammates for a player"""
-    if len(st.session_state.matches) == 0:
-        return []
-
-    matches = st.session_state.matches
-
-    # Find teammates from team1
-    team1_mates = matches[matches['team1_player1'] == player_name]['team1_player2'].tolist() + \
-                 matches[matches['team1_player2'] == player_name]['team1_player1'].tolist()
+    names, pairs = _pairs_of(player_name)
+    teammates = [(entry[0], other_id) for other_id, entry in pairs.items() if entry[0] > 0]
+    teammates.sort(key=lambda item: (-item[0], str(names[item[1]])))
+    return [{"name": names[other_id], "count": count} for count, other_id in teammates[:limit]]
 
-    # Find teammates from team2
-    team2_mates = matches[matches['team2_player1'] == player_name]['team2_player2'].tolist() + \
-                 matches[matches['team2_player2'] == player_name]['team2_player1'].tolist()
-
-    # Combine and count
-    all_teammates = team1_mates + team2_mates
+def get_best_partners(player_name, limit=3, min_games=MIN_PAIR_GAMES):
+    """Teammates with the highest win rate together, over at least min_games games"""
+    names, pairs = _pairs_of(player_name)
+    partners = [
+        {"name": names[other_id], "games": entry[0], "wins": entry[1], "win_rate": entry[1] / entry[0] * 100}
+        for other_id, entry in pairs.items() if entry[0] >= min_games
+    ]
+    partners.sort(key=lambda partner: (-partner['win_rate'], -partner['games'], str(partner['name'])))
+    return partners[:limit]
 
-    if not all_teammates:
-        return []
+def get_nemeses(player_name, limit=3, min_games=MIN_PAIR_GAMES):
+    """Opponents the player loses to most often, over at least min_games games"""
+    names, pairs = _pairs_of(player_name)
+    nemeses = [
+        {"name": names[other_id], "games": entry[2], "losses": entry[2] - entry[3],
+         "loss_rate": (entry[2] - entry[3]) / entry[2] * 100}
+        for other_id, entry in pairs.items() if entry[2] >= min_games
+    ]
+    nemeses.sort(key=lambda nemesis: (-nemesis['loss_rate'], -nemesis['games'], str(nemesis['name'])))
+    return nemeses[:limit]
 
-    teammate_counts = pd.Series(all_teammates).value_counts().head(limit)
+def get_head_to_head(player_name, other_name):
+    """Games and wins of player_name together with and against other_name"""
+    league = get_league()
+    _, pairs = _pairs_of(player_name)
+    games_with, wins_with, games_against, wins_against = pairs.get(league.player_ids.get(other_name), [0, 0, 0, 0])
+    return {
+        'games_with': games_with,
+        'wins_with': wins_with,
+        'games_against': games_against,
+        'wins_against': wins_against,
+    }
 
-    return [{"name": name, "count": count} for name, count in teammate_counts.items()]
+def get_player_details(player_name):
+    """Stats and frequent teammates of one player, cached until the player's next match"""
+    league = get_league()
+    stats = get_player_stats(player_name)
+    # A player's match count only changes when they play; loaded_at changes on every reload
+    version = (league.loaded_at, stats['matches_played'])
+    return league.cached(('player_details', player_name),
+                         lambda: {'stats': stats,
+                                  'teammates': get_most_frequent_teammates(player_name),
+                                  'best_partners': get_best_partners(player_name, limit=1),
+                                  'nemeses': get_nemeses(player_name, limit=1)},
+                         version=version)
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from match_log import NAT
+
+# Matches appended since the last build are counted by scanning them; past this
+# many (or an eighth of the indexed matches) the index is rebuilt
+MIN_REBUILD_TAIL = 1024
+
+
+def _to_nanoseconds(date, default):
+    return default if date is None else int(pd.Timestamp(date).value)
+
+
+class WindowStats:
+    """Per-player matches and wins over any date window, from prefix sums.
+
+    Every (player, match) entry of the log is sorted by player, then date, and
+    wins are summed cumulatively along that order. A window [start, end) is
+    then two binary searches per player and a subtraction, however long the
+    history. Matches appended after the index was built form a tail that is
+    counted directly until the next rebuild.
+    """
+
+    def __init__(self, match_log):
+        self.match_log = match_log
+        self.size = len(match_log)
+
+        ids = match_log.player_ids()
+        winner = match_log.column('winner')
+        players = ids.ravel().astype(np.int64)
+        dates = np.repeat(match_log.column('date'), 4)
+        # Seats 0-1 are team 1, seats 2-3 team 2
+        won = np.stack([winner == 1, winner == 1, winner == 2, winner == 2], axis=1).ravel()
+
+        order = np.lexsort((dates, players))
+        players, dates, won = players[order], dates[order], won[order]
+        # Dates become dense ranks so (player, date) fits one sortable int64 key
+        self._dates = np.unique(dates)
+        self._stride = len(self._dates) + 1
+        self._keys = players * self._stride + np.searchsorted(self._dates, dates)
+        self._cumulative_wins = np.concatenate([[0], np.cumsum(won, dtype=np.int64)])
+
+    @property
+    def nbytes(self):
+        return self._dates.nbytes + self._keys.nbytes + self._cumulative_wins.nbytes
+
+    def needs_rebuild(self, match_log):
+        """True if match_log is not the log this index covers or its tail grew too long"""
+        tail = len(match_log) - self.size
+        return match_log is not self.match_log or tail > max(MIN_REBUILD_TAIL, self.size // 8)
+
+    def counts(self, player_count, start=None, end=None):
+        """(matches, wins) arrays by player id for matches dated in [start, end).
+
+        Without bounds every match counts, including those without a date.
+        """
+        start = _to_nanoseconds(start, NAT)
+        end = _to_nanoseconds(end, None)
+        base = np.arange(player_count, dtype=np.int64) * self._stride
+
+        first = np.searchsorted(self._keys, base + np.searchsorted(self._dates, start))
+        stop_rank = len(self._dates) if end is None else np.searchsorted(self._dates, end)
+        last = np.searchsorted(self._keys, base + stop_rank)
+        matches = last - first
+        wins = self._cumulative_wins[last] - self._cumulative_wins[first]
+
+        if len(self.match_log) > self.size:
+            tail_matches, tail_wins = self._count_tail(player_count, start, end)
+            matches, wins = matches + tail_matches, wins + tail_wins
+        return matches, wins
+
+    def _count_tail(self, player_count, start, end):
+        tail = self.match_log.take(np.arange(self.size, len(self.match_log)))
+        dates = tail.column('date')
+        in_window = dates >= start
+        if end is not None:
+            in_window &= dates < end
+        ids = tail.player_ids()[in_window]
+        winner = tail.column('winner')[in_window]
+        won = np.stack([winner == 1, winner == 1, winner == 2, winner == 2], axis=1)
+        matches = np.bincount(ids.ravel(), minlength=player_count)[:player_count]
+        wins = np.bincount(ids.ravel(), weights=won.ravel(), minlength=player_count)[:player_count]
+        return matches, wins.astype(np.int64)
@@ -0,0 +1,86 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Persist changesets on a background thread so the UI never waits on I/O.
+
+    Changesets are written strictly in submission order. Whatever piled up while
+    a write was in flight is coalesced with `merge` into as few writes as
+    possible. A failed write is retried with exponential backoff and is never
+    skipped, so later changesets cannot overtake it.
+    """
+
+    def __init__(self, write, merge=None, max_backoff=60.0):
+        self._write = write
+        self._merge = merge or (lambda changesets: changesets)
+        self._max_backoff = max_backoff
+        self._pending = deque()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, changeset):
+        """Queue a changeset and return immediately"""
+        with self._condition:
+            self._pending.append(changeset)
+            self._condition.notify_all()
+
+    def pending(self):
+        """Number of submitted changesets not yet durably written"""
+        with self._condition:
+            return len(self._pending) + self._in_flight
+
+    def flush(self, timeout=None):
+        """Block until every submitted changeset is written; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                batch = list(self._pending)
+                self._pending.clear()
+                self._in_flight = len(batch)
+
+            for changeset in self._merge(batch):
+                self._write_with_retry(changeset)
+
+            with self._condition:
+                self._in_flight = 0
+                self._condition.notify_all()
+
+    def _write_with_retry(self, changeset):
+        backoff = 1.0
+        while True:
+            try:
+                self._write(changeset)
+                self.last_error = None
+                return
+            except Exception as exc:  # keep the writer alive whatever the backend raises
+                self.last_error = exc
+                logger.warning("Write failed, retrying in %.0fs: %s", backoff, exc)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self._max_backoff)
+
+
+def start_write_behind_queue(write, merge=None, shutdown_timeout=30.0):
+    """Create a queue whose pending writes are flushed when the process exits"""
+    write_queue = WriteBehindQueue(write, merge)
+    atexit.register(write_queue.flush, shutdown_timeout)
+    return write_queue